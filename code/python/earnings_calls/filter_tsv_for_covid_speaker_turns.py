@@ -11,7 +11,12 @@ python3 filter_tsv_for_covid_speaker_turns.py
 """
 
 import csv
+import os
+import re
+import sys
 from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.lexicon_matcher import LexiconMatcher
 
 def read_tsv_to_list_of_lists(tsv_path):
     """ takes tsv_path (the path to a TSV file of speaker turns, where each row corresponds to one speaker turn
@@ -42,6 +47,8 @@ def filter_for_covid_speaker_turns(tsv_rows, covid_lexicon):
         returns an updated list of lists where only speaker turns that contain 1+ token(s) in the COVID lexicon are retained
     """
     updated_tsv_rows = []
+    # All lexicon entries compiled into one pattern, matched case-sensitively like the `in` checks
+    matcher = LexiconMatcher(covid_lexicon, ignore_case=False)
 
     # Use a dictionary to count how many times we see each COVID word type as a check that this script is identifying COVID speaker turns correctly.
     covid_word_types_seen = defaultdict(int)
@@ -51,29 +58,21 @@ def filter_for_covid_speaker_turns(tsv_rows, covid_lexicon):
         curr_filename = row[1]
         curr_speaker_text = row[2]
 
-        # curr_speaker_text string has tokens (including multiword phrase tokens) separated by spaces
-        # Create curr_speaker_tokens list of tokens from curr_speaker_text string.
-        curr_speaker_tokens = curr_speaker_text.split()
-
-        # Check if current speaker turn is a COVID speaker turn.
-        # For every token in the speaker turn text (where a token might be a multiword phrase combined by underscores)...
-        for token in curr_speaker_tokens:
-            # For every word type in COVID lexicon, check if that COVID word type is part of any token in the current speaker turns.
-            # We do this instead of checking directly for equality (between the COVID word type and the speaker turn token)
-            # because combining multiword phrases may have made it so that some COVID words were combined into multiword phrases with underscores,
-            # so they won't appear in the speaker tokens exactly how they do in the lexicon.
-            is_covid_speaker_turn = False # assume current speaker turn is not COVID speaker turn to begin with
-            for covid_word_type in covid_lexicon:
-                if covid_word_type in token:
-                    print("token:", token)
-                    is_covid_speaker_turn = True
-                    covid_word_types_seen[covid_word_type] += 1
-                    break # just need to see one COVID word type for this to be considered a COVID speaker turn
-            
-            if is_covid_speaker_turn:
-                # Use curr_speaker_text, not curr_speaker_tokens here, so that the speaker turn text will be a complete string, not a list of token strings, in the output TSV file.
-                updated_tsv_rows.append([curr_id, curr_filename, curr_speaker_text])
-                break # just need to add this row once, once we know it has at least one COVID word type
+        # Check if current speaker turn is a COVID speaker turn: does any COVID word type show up as part of any token?
+        # We check for substrings instead of equality (between the COVID word type and the speaker turn token)
+        # because combining multiword phrases may have made it so that some COVID words were combined into multiword phrases with underscores,
+        # so they won't appear in the speaker tokens exactly how they do in the lexicon.
+        # Lexicon entries have no spaces, so one search over the whole text finds the first token holding one.
+        match = matcher.search_substring(curr_speaker_text)
+        if match is not None:
+            # The token (tokens are separated by whitespace) the first match is in
+            start = re.search(r'\S*$', curr_speaker_text[:match.start()]).start()
+            token = curr_speaker_text[start:].split(maxsplit=1)[0]
+            print("token:", token)
+            # Count the first COVID word type in lexicon order that is part of that token, as the check always did
+            covid_word_types_seen[next(w for w in covid_lexicon if w in token)] += 1
+            # Use curr_speaker_text, not a list of tokens here, so that the speaker turn text will be a complete string in the output TSV file.
+            updated_tsv_rows.append([curr_id, curr_filename, curr_speaker_text])
     
         # print statement to display progress
         print("filter_for_covid_speaker_turns", curr_filename)
@@ -1,19 +1,35 @@
 import os
 import sys
 from random import random
+from pmicalc.chunk_index import read_file_index
 
 '''
-fix_chunks.py [directory_of_chunk_files] [output_file]
+fix_chunks.py [directory_of_chunk_files] [output_file] [--index]
+
+With --index it also reads the .idx offset files lexicon_chunking.py writes with
+chunk_output 'index' and writes [output_file]_index.txt and [output_file]-test_index.txt
+with Identifier, Filename, Source, Start and End per passage, no text. Both are written in
+the same pass as the text files with the same test split, so a chunk is in the test index
+exactly when it is in [output_file]-test.txt. A chunk with only an .idx file (chunk_output
+'index' alone) gets just its index rows. pmicalc/chunk_index.py reads the text of any of
+them back from the filings.
 '''
-def main(d,output):
+def main(d,output,index=False):
 	directory = os.listdir(d)
 	n = len(directory)
 	# save 5 % for testing
 	num_test = int(0.05 * n)
 	test_set = {int((n+1)*random()) for x in range(num_test)} 
+	names = set(directory)
 	outfile = open(f'{output}.txt','a')
 	testfile = open(f'{output}-test.txt','a')
+	if index:
+		out_index = open(f'{output}_index.txt','a')
+		test_index = open(f'{output}-test_index.txt','a')
 	for i, filename in enumerate(directory):
+		if index and filename.endswith('.idx') and filename[:-len('.idx')] + '.txt' not in names:
+			#No text file to take the split from, the .idx's own position decides
+			write_index(os.path.join(d,filename), test_index if i in test_set else out_index)
 		if not filename.endswith('.txt'):
 			continue
 		text = open(os.path.join(d,filename),'r')
@@ -24,8 +40,18 @@ def main(d,output):
 			else:
 				outfile.write(f'{filename}-{idx}\t{filename}\t{chunk}\n')
 		text.close()
+		index_name = filename[:-len('.txt')] + '.idx'
+		if index and index_name in names:
+			write_index(os.path.join(d,index_name), test_index if i in test_set else out_index)
 	outfile.close()
 	testfile.close()
+	if index:
+		out_index.close()
+		test_index.close()
+
+def write_index(path,out):
+	for row in read_file_index(path):
+		out.write('\t'.join(str(x) for x in row) + '\n')
 
 if __name__ == '__main__':
-	main(sys.argv[1],sys.argv[2])
+	main(sys.argv[1],sys.argv[2],'--index' in sys.argv[3:])
@@ -1,67 +1,362 @@
-import nltk
-from nltk import ngrams
-from nltk.corpus import PlaintextCorpusReader, stopwords
-from nltk.tokenize import RegexpTokenizer
+from nltk.corpus import PlaintextCorpusReader
+import multiprocessing
 import pandas as pd
-import string
 import os
-import math
-from sklearn.feature_extraction.text import CountVectorizer
+import re
 import numpy as np
-import math
-import pickle
 import csv
-import regex as re
-
-#Variables that specify where the data is
-data_dir = '/newdata'
-data_folder = '10-19_DATA_CLEAN_2021'
-output_dir = '/newdata'
-file_type = '10KQ_2021'
-#Get lexicon and filter the escape chars
-lexicon = [item for sublist in list(csv.reader(open('lexicon.csv'))) for item in sublist]
-lexicon[0] = 'coronavirus'
-lex = set(lexicon)
-print(f'lexicon loaded, {lexicon}')
-#Get vocab as a set for fast lookup
-vocab = set(np.load('vocab_final_11-8.npz')['vocabulary'])
-#Initialize tokenizers and variables for track progress in the console
-
-token_reg = r"[A-Za-z]+-[A-Za-z]+-[0-9]|[a-zA-Z0-9]+-[a-zA-Z0-9]+|[a-zA-Z0-9]+" 
-regex_tokenizer = RegexpTokenizer(token_reg)
-os.chdir(data_dir)
-corpus = PlaintextCorpusReader(data_folder, '.*txt',word_tokenizer=regex_tokenizer)
-print('corpus loaded')
-files = corpus.fileids()
-count = len(files)
-progress = 0
-
-
-# Data frame with a column with the file name, the file's word count, total lexicon proportion,
-# and the proportion of each word in the lexicon
-df_counts = pd.DataFrame(index = files, columns=['CIK', 'TokenCount','TotalProportion'] + lexicon, dtype=np.float32)
-df_counts[df_counts != 0] = 0
-for f in files:
-        print(f'File name: {f} , progress: {progress}/{count}')
-        total,token_count = 0,0
-        for word in corpus.words(f):
-                word_lower = word.lower()
-                if word_lower in vocab:
-                        token_count += 1
-                        if word_lower in lex:
-                                df_counts.loc[f, word_lower] += 1
-                                total += 1
-        if token_count == 0:
-                continue
-        df_counts.loc[f, 'TotalProportion'] = total
-        df_counts.loc[f, ['TokenCount','TotalProportion']+lexicon] = df_counts.loc[f].apply(lambda x: x/token_count)
-        df_counts.loc[f, 'TokenCount'] = token_count
-        cik = f[4:]
-        cik = cik.split('-')[0]
-        df_counts.loc[f, 'CIK'] = cik
-        progress += 1
-
-os.chdir(output_dir)
-print('Finished. Dumping to Lexicon_Proportions.csv in ' + output_dir)
-df_counts[['CIK', 'TokenCount','TotalProportion']].to_csv('Lexicon_Proportions_' + file_type +'.csv')
-df_counts.to_csv('Lexicon_Proportions_Total_' + file_type +'.csv')
+from pmicalc.corpus import token_pattern
+from pmicalc.lexicon_matcher import LexiconMatcher, LexiconSet
+from pmicalc.token_cache import TokenCache
+
+'''
+Lexicon proportions for every filing in a folder: how many of a filing's vocabulary tokens
+are lexicon words, in total and per word.
+
+Each file is turned into an array of vocabulary ids once, its token count is the number of
+ids that are in the vocabulary and its lexicon counts come from the shared LexiconMatcher
+(one bincount for words, one comparison per word for phrases). Files whose raw text has no
+lexicon entry at all skip the counting. The
+counts of all files are stacked and divided in one go, so the data frame is built once at
+the end instead of being filled in cell by cell.
+
+Several year folders can be done in one run on a process pool. Workers only send back a
+token count and a small count array per file, so memory stays at one file's text per
+worker however big the folders are, and every year comes out in the same file order as a
+run on its own.
+
+Several named lexicons (a COVID one, a supply chain one, ...) can be counted in the same
+pass: the files are counted once against all their entries, phrases included, and the
+counts are split into a proportions table per lexicon afterwards, so another lexicon only
+adds its share of the matching.
+
+Besides csv the tables can be written as parquet or feather (both need pyarrow) or as Stata
+.dta files, with typed columns: File and CIK as strings, TokenCount as an integer and the
+proportions as float32. read_proportions reads the years back and appends them.
+'''
+
+#Set once per worker by the pool initializer
+_word_map = None
+_matcher = None
+_columns = None
+_phrases = None
+_token_cache = None
+
+#File suffix of every output format
+output_suffixes = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'dta': '.dta'}
+
+
+def load_lexicon(path='lexicon.csv'):
+        #Get lexicon and filter the escape chars
+        lexicon = [item for sublist in list(csv.reader(open(path))) for item in sublist]
+        lexicon[0] = 'coronavirus'
+        return lexicon
+
+
+def read_lexicon(path):
+        #Any lexicon csv, one entry per cell, without the byte order mark Excel puts in front
+        with open(path, newline='', encoding='utf-8-sig') as lexicon_file:
+                return [item for row in csv.reader(lexicon_file) for item in row]
+
+
+def lexicon_index(vocab, lexicon):
+        '''
+        Returns the vocabulary word map, the compiled lexicon matcher and its vocabulary
+        columns and phrases. Lexicon words outside the vocabulary never get counted.
+        '''
+        word_map = {w: i for i, w in enumerate(vocab)}
+        matcher = LexiconMatcher(lexicon, verbatim=True)
+        columns, phrases = matcher.vocab_columns(word_map)
+        return word_map, matcher, columns, phrases
+
+
+def count_file(path, word_map, matcher, columns, phrases, token_cache=None):
+        '''Returns the file's vocabulary token count and its count of every lexicon entry (in matcher.terms order)'''
+        if token_cache is not None:
+                #The cache has the same tokens, already lowercased
+                ids = token_cache.vocab_ids(path, word_map)
+                hit = True
+        else:
+                with open(path, 'r', encoding='utf-8') as raw_file:
+                        text = raw_file.read()
+                #Same tokens corpus.words gives, matched on the raw text and then lowercased
+                tokens = token_pattern.findall(text)
+                ids = np.fromiter((word_map.get(t.lower(), -1) for t in tokens), dtype=np.int64, count=len(tokens))
+                #Files with no lexicon entry anywhere in the text skip the counting
+                hit = matcher.prefilter(text)
+        token_count = int((ids >= 0).sum())
+        if not hit:
+                return token_count, np.zeros(len(matcher.terms), dtype=np.int64)
+        return token_count, matcher.count_ids(ids, columns, phrases)
+
+
+def proportions_frame(files, token_counts, lex_counts, lexicon, unique):
+        '''
+        Data frame with a column with the file name, the file's word count, total lexicon
+        proportion, and the proportion of each word in the lexicon. Files without tokens are
+        all zeros. Values are float32 like the frame the cell by cell version filled in.
+        '''
+        token_counts = np.asarray(token_counts, dtype=np.int64)
+        lex_counts = np.asarray(lex_counts, dtype=np.int64).reshape(len(files), len(unique))
+        counted = token_counts > 0
+        #Divided in float64 and then stored as float32, as the row by row division did
+        denominator = np.where(counted, token_counts, 1).astype(np.float64)[:, None]
+        proportions = np.where(counted[:, None], lex_counts / denominator, 0).astype(np.float32)
+        total = np.where(counted, lex_counts.sum(axis=1) / denominator[:, 0], 0).astype(np.float32)
+        #Lexicon columns in file order. Entries are matched as written, so blank ones and ones
+        #with spaces around them (or capitals) are never counted and stay zero
+        position = {w: j for j, w in enumerate(unique)}
+        proportions = np.concatenate([proportions, np.zeros((len(files), 1), dtype=np.float32)], axis=1)
+        columns = [position.get(w, len(unique)) for w in lexicon]
+        df_lex = pd.DataFrame(proportions[:, columns], index=files, columns=lexicon)
+        ciks = [f[4:].split('-')[0] if c else 0.0 for f, c in zip(files, counted)]
+        df_head = pd.DataFrame({'CIK': pd.Series(ciks, index=files, dtype=object if counted.any() else np.float32),
+                                'TokenCount': token_counts.astype(np.float32),
+                                'TotalProportion': total}, index=files)
+        return pd.concat([df_head, df_lex], axis=1)
+
+
+def folder_counts(folder, vocab, lexicon, token_cache=None):
+        '''
+        Counts every .txt file under folder and returns (files, token counts, files x entries
+        lexicon counts), files being paths within folder and the entries in LexiconMatcher order
+        '''
+        files = PlaintextCorpusReader(folder, '.*txt').fileids()
+        word_map, matcher, columns, phrases = lexicon_index(vocab, lexicon)
+        token_counts = np.zeros(len(files), dtype=np.int64)
+        lex_counts = np.zeros((len(files), len(matcher.terms)), dtype=np.int64)
+        for i, f in enumerate(files):
+                if i % 500 == 0:
+                        print(f'File name: {f} , progress: {i}/{len(files)}')
+                token_counts[i], lex_counts[i] = count_file(os.path.join(folder, f), word_map, matcher, columns, phrases, token_cache)
+        return files, token_counts, lex_counts
+
+
+def folder_proportions(folder, vocab, lexicon, token_cache=None):
+        '''Counts every .txt file under folder and returns the proportions frame, indexed by path within folder'''
+        files, token_counts, lex_counts = folder_counts(folder, vocab, lexicon, token_cache)
+        return proportions_frame(files, token_counts, lex_counts, lexicon, LexiconMatcher(lexicon, verbatim=True).terms)
+
+
+def _init_worker(vocab, lexicon, cache_dir):
+        global _word_map, _matcher, _columns, _phrases, _token_cache
+        _word_map, _matcher, _columns, _phrases = lexicon_index(vocab, lexicon)
+        _token_cache = None if cache_dir is None else TokenCache(cache_dir)
+
+
+def _count_task(task):
+        i, path = task
+        token_count, counts = count_file(path, _word_map, _matcher, _columns, _phrases, _token_cache)
+        return i, token_count, counts
+
+
+def folder_year(folder):
+        #10-19_DATA_CLEAN_2021 -> 2021
+        return re.findall(r'\d{4}', os.path.basename(os.path.normpath(folder)))[-1]
+
+
+def parallel_counts(folders, vocab, lexicon, processes=None, cache_dir=None, chunksize=16):
+        '''
+        Counts the files of several folders on one pool and returns folder_counts' (files,
+        token counts, lexicon counts) for every folder, in the order of folders
+        '''
+        file_lists = [PlaintextCorpusReader(folder, '.*txt').fileids() for folder in folders]
+        paths = [os.path.join(folder, f) for folder, files in zip(folders, file_lists) for f in files]
+        tasks = list(enumerate(paths))
+        unique = LexiconMatcher(lexicon, verbatim=True).terms
+        token_counts = np.zeros(len(tasks), dtype=np.int64)
+        lex_counts = np.zeros((len(tasks), len(unique)), dtype=np.int64)
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(processes, initializer=_init_worker, initargs=(list(vocab), lexicon, cache_dir)) as pool:
+                #Results land in their own row, so the order they finish in does not matter
+                for done, (i, token_count, counts) in enumerate(pool.imap_unordered(_count_task, tasks, chunksize)):
+                        token_counts[i], lex_counts[i] = token_count, counts
+                        if done % 5000 == 0:
+                                print(f'Counted {done}/{len(tasks)} files')
+        counted, start = [], 0
+        for files in file_lists:
+                end = start + len(files)
+                counted.append((files, token_counts[start:end], lex_counts[start:end]))
+                start = end
+        return counted
+
+
+def parallel_proportions(folders, vocab, lexicon, processes=None, cache_dir=None, chunksize=16):
+        '''
+        Counts the files of several folders on one pool and returns a proportions frame per
+        folder, in the order of folders, each in the same file order folder_proportions uses
+        '''
+        unique = LexiconMatcher(lexicon, verbatim=True).terms
+        return [proportions_frame(files, token_counts, lex_counts, lexicon, unique)
+                for files, token_counts, lex_counts in parallel_counts(folders, vocab, lexicon, processes, cache_dir, chunksize)]
+
+
+def theme_frames(files, token_counts, lex_counts, lexicons):
+        '''
+        Splits the counts of one pass over the entries of several named lexicons ({name:
+        entries}, counted as union_lexicon) into a proportions frame for every lexicon, plus
+        one frame with CIK, TokenCount and the TotalProportion of every lexicon as <name>
+        '''
+        lexicon_set = LexiconSet(lexicons, verbatim=True)
+        split = lexicon_set.split(lex_counts)
+        frames = {name: proportions_frame(files, token_counts, split[name], lexicons[name], lexicon_set.terms[name])
+                  for name in lexicon_set.names}
+        first = frames[lexicon_set.names[0]]
+        totals = pd.DataFrame({name: frame['TotalProportion'] for name, frame in frames.items()}, index=first.index)
+        return frames, pd.concat([first[['CIK', 'TokenCount']], totals], axis=1)
+
+
+def union_lexicon(lexicons):
+        #Entries of every named lexicon in one list, to count them all in one pass
+        return [t for lexicon in lexicons.values() for t in lexicon]
+
+
+def combined_panel(frames, years):
+        '''All years stacked into one frame with Year and File columns in front'''
+        panel = pd.concat(frames, keys=years, names=['Year', 'File'])
+        return panel.reset_index()
+
+
+def typed_frame(df_counts):
+        '''
+        The proportions frame with the file name as a File column and typed columns: CIK as a
+        string ('' for files without tokens), TokenCount as an integer, proportions as float32.
+        Also takes a frame read back from the csv.
+        '''
+        df = df_counts.rename_axis('File').reset_index()
+        df['File'] = df['File'].astype(str)
+        token_counts = df['TokenCount'].to_numpy(dtype=np.int64)
+        df['TokenCount'] = token_counts
+        df['CIK'] = np.where(token_counts > 0, df['CIK'].astype(str), '').astype(object)
+        for c in df.columns[df.columns.get_loc('TokenCount') + 1:]:
+                df[c] = df[c].astype(np.float32)
+        return df
+
+
+def stata_names(columns):
+        '''
+        Variable names the way import delimited makes them from the csv header: lowercase,
+        only letters, digits and _, at most 32 characters, made unique with a number
+        '''
+        names, seen = [], set()
+        for c in columns:
+                name = re.sub(r'[^a-z0-9_]', '', str(c).lower())[:32]
+                if not name or name[0].isdigit():
+                        name = ('_' + name)[:32]
+                base, n = name, 1
+                while name in seen:
+                        n += 1
+                        name = base[:32 - len(str(n))] + str(n)
+                seen.add(name)
+                names.append(name)
+        return names
+
+
+def write_typed(df, stem, fmt):
+        '''Writes an already typed frame (typed_frame or stack_years) to stem plus the suffix of fmt'''
+        path = stem + output_suffixes[fmt]
+        if fmt == 'parquet':
+                df.to_parquet(path, index=False)
+        elif fmt == 'feather':
+                df.to_feather(path)
+        elif fmt == 'dta':
+                df = df.set_axis(stata_names(df.columns), axis=1)
+                df.to_stata(path, write_index=False, version=118)
+        else:
+                df.to_csv(path, index=False)
+        return path
+
+
+def write_proportions(df_counts, stem, fmt='csv'):
+        '''Writes a proportions frame to stem plus the suffix of fmt, csv as the file indexed csv it always was'''
+        if fmt not in output_suffixes:
+                raise ValueError('Unknown output format ' + str(fmt) + ', expected one of ' + ', '.join(output_suffixes))
+        if fmt == 'csv':
+                df_counts.to_csv(stem + '.csv')
+                return stem + '.csv'
+        return write_typed(typed_frame(df_counts), stem, fmt)
+
+
+def read_proportions(years, fmt='parquet', output_dir='.', total=True, prefix='10KQ_'):
+        '''
+        Reads the tables written for several years (Lexicon_Proportions_Total_<prefix><year>,
+        or the short ones with total False) and returns them appended, with an integer Year
+        column in front. The columns are typed the same whatever fmt they were written in
+        (dta keeps its Stata variable names).
+        '''
+        stem = 'Lexicon_Proportions_Total_' if total else 'Lexicon_Proportions_'
+        typed = []
+        for year in years:
+                path = os.path.join(output_dir, stem + prefix + str(year) + output_suffixes[fmt])
+                if fmt == 'parquet':
+                        typed.append(pd.read_parquet(path))
+                elif fmt == 'feather':
+                        typed.append(pd.read_feather(path))
+                elif fmt == 'dta':
+                        typed.append(pd.read_stata(path))
+                else:
+                        typed.append(typed_frame(pd.read_csv(path, index_col=0, dtype={'CIK': str})))
+        return stack_years(typed, years)
+
+
+def stack_years(typed, years):
+        '''Typed frames of several years appended into one, with an integer Year column in front'''
+        panel = pd.concat([df.assign(Year=int(year)) for df, year in zip(typed, years)], ignore_index=True)
+        return panel[['Year'] + [c for c in panel.columns if c != 'Year']]
+
+
+if __name__ == '__main__':
+        #Variables that specify where the data is
+        data_dir = '/newdata'
+        data_folder = '10-19_DATA_CLEAN_2021'
+        output_dir = '/newdata'
+        file_type = '10KQ_2021'
+        #Token cache made by pmicalc/token_cache.py, None tokenizes the raw files
+        cache_dir = None
+        #Year folders to do in one parallel run (file_type becomes 10KQ_<year>), None does data_folder alone
+        data_folders = ['10-19_DATA_CLEAN_2019', '10-19_DATA_CLEAN_2020', '10-19_DATA_CLEAN_2021']
+        processes = os.cpu_count()
+        #Also write all the years stacked into Lexicon_Proportions_Total_10KQ_panel.csv
+        combined = False
+        #csv, parquet, feather (both need pyarrow) or dta for Stata
+        output_format = 'csv'
+        #Named lexicons counted in the same pass, e.g. {'covid': 'lexicon.csv', 'supply_chain': 'supply_chain.csv'}.
+        #Each gets a Lexicon_Proportions_Total_<name>_<file_type> table and its TotalProportion as
+        #the <name> column of Lexicon_Proportions_<file_type>. None counts lexicon.csv alone.
+        lexicons = None
+
+        if lexicons is None:
+                lexicon = load_lexicon()
+                print(f'lexicon loaded, {lexicon}')
+        else:
+                themes = {name: read_lexicon(path) for name, path in lexicons.items()}
+                lexicon = union_lexicon(themes)
+                print(f'lexicons loaded, {themes}')
+        vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+        if data_folders is None:
+                token_cache = None if cache_dir is None else TokenCache(cache_dir)
+                counted = {file_type: folder_counts(os.path.join(data_dir, data_folder), vocab, lexicon, token_cache)}
+        else:
+                counts = parallel_counts([os.path.join(data_dir, d) for d in data_folders], vocab, lexicon, processes, cache_dir)
+                years = [folder_year(d) for d in data_folders]
+                counted = {'10KQ_' + year: c for year, c in zip(years, counts)}
+
+        os.chdir(output_dir)
+        frames = []
+        for file_type, (files, token_counts, lex_counts) in counted.items():
+                print('Finished. Dumping to Lexicon_Proportions_' + file_type + output_suffixes[output_format] + ' in ' + output_dir)
+                if lexicons is None:
+                        df_counts = proportions_frame(files, token_counts, lex_counts, lexicon, LexiconMatcher(lexicon, verbatim=True).terms)
+                        write_proportions(df_counts[['CIK', 'TokenCount','TotalProportion']], 'Lexicon_Proportions_' + file_type, output_format)
+                        write_proportions(df_counts, 'Lexicon_Proportions_Total_' + file_type, output_format)
+                else:
+                        theme_tables, df_counts = theme_frames(files, token_counts, lex_counts, themes)
+                        write_proportions(df_counts, 'Lexicon_Proportions_' + file_type, output_format)
+                        for name, df_theme in theme_tables.items():
+                                write_proportions(df_theme, 'Lexicon_Proportions_Total_' + name + '_' + file_type, output_format)
+                frames.append(df_counts)
+        if data_folders is not None and combined:
+                if output_format == 'csv':
+                        combined_panel(frames, years).to_csv('Lexicon_Proportions_Total_10KQ_panel.csv', index=False)
+                else:
+                        write_typed(stack_years([typed_frame(f) for f in frames], years), 'Lexicon_Proportions_Total_10KQ_panel', output_format)
@@ -12,78 +12,225 @@ import math
 import pickle
 import csv
 import regex as re
+from pmicalc.corpus import token_pattern, token_reg
+from pmicalc.lexicon_matcher import LexiconSet
+from pmicalc.chunk_index import byte_offsets, write_file_index
+from pmicalc.run_manager import RunManager, write_atomic
+from pmicalc.sentence_split import sentence_spans
 
 '''
 1.) Find each sentence with a  lexicon word in each file
 2.) Get plus/minus (sent_window) sentences around each sentence found in step 1
 3.) Dump them all into a file
+With several lexicons every sentence is checked against all of them at once and every
+lexicon gets its own chunk files.
+Sentences come from the rule-based splitter in pmicalc/sentence_split.py as character
+offsets, so every chunk is one slice of the original text with its punctuation, and can
+also be written as just its byte offsets (pmicalc/chunk_index.py).
+Files are spread over a process pool by pmicalc/run_manager.py, which keeps a manifest of
+the finished ones so a rerun after a crash carries on where the last one stopped.
 '''
 
 
-#Variables that specify where the data is - Set for antiviral words in 2019
-data_dir = '/newdata'
-data_folder = '10-19_DATA_CLEAN_2021'
-output_dir = '/newdata/2021_Chunked_Files'
-file_type = '10KQ'
+def window_chunks(sentences, hits, sent_window):
+    '''
+    Chunks of the sentences within sent_window of the hit sentences (indices, in order),
+    overlapping windows run together into one chunk
+    '''
+    chunks = []
+    n_sents = len(sentences)
+    last_up = 0
+    for i in hits:
+        #Get the window of sentences
+        upper = min(i+sent_window+1, n_sents)
+        if i <= last_up and chunks:
+            lower = last_up
+            chunk = [' '.join(s) for s in sentences[lower:upper]]
+            #Get last chunk and add to end of it
+            chunks[-1] += ''.join(chunk)
+        else:
+            lower = max(i-sent_window,0)
+            #Flatten into list of sentence strings
+            chunk = [' '.join(s) for s in sentences[lower:upper]]
+            chunk.append('\n')
+            #Add to chunks but flatten list into 1 string
+            chunks.append('. '.join(chunk))
+        last_up = upper
+    return chunks
 
 
-#Get lexicon and filter the escape chars
-lexicon = [item for sublist in list(csv.reader(open('../../outputs/core_lexicon.csv'))) for item in sublist]
-lex = set(lexicon)
-lex.remove('')
-print('lexicon loaded')
-print(f'Current lexicon: {lex}')
+def write_chunks(path, chunks):
+    #Flatten into one long string with newlines in between each chunk, written atomically
+    write_atomic(path, '\n'.join(chunks))
 
-#Initialize tokenizers and variables for track progress in the console
-token_reg = r"[A-Za-z]+-[A-Za-z]+-[0-9]|[a-zA-Z0-9]+-[a-zA-Z0-9]+|[a-zA-Z0-9]+"
-regex_tokenizer = RegexpTokenizer(token_reg)
-os.chdir(data_dir)
-corpus = PlaintextCorpusReader(data_folder, '.*txt',word_tokenizer=regex_tokenizer)
-print('corpus loaded')
 
-files = corpus.fileids()
-#files = list(pd.read_csv('/data/antiviral_2019_data.csv').File)
-count = len(files)
-progress = 1
+def read_lexicons(lexicons):
+    '''LexiconSet for the lexicons config, core_lexicon.csv on its own (named None) if that is None'''
+    if lexicons is None:
+        #Get lexicon and filter the escape chars
+        lexicon = [item for sublist in list(csv.reader(open('../../outputs/core_lexicon.csv'))) for item in sublist]
+        lex = set(lexicon)
+        lex.remove('')
+        return LexiconSet({None: lex}, verbatim=True)
+    return LexiconSet({name: [item for row in csv.reader(open(path, newline='', encoding='utf-8-sig')) for item in row]
+                       for name, path in lexicons.items()}, verbatim=True)
 
 
-#Scan each file
-# OOOOXOXOOXOXOOOOXOO -> OO(OOXOXOOXOXOO)(OOXOO)
-os.chdir(output_dir)
-sent_window = 2
-for f in files[5701:]:
-    chunks = []
-    print(f'File name: {f} , progress: {progress}/{count}')
-    sentences = corpus.sents(f)
-    n_sents = len(sentences)
-    last_up = 0
+def _hit_names(lexicon_set, tokens):
+    #A second lexicon word in the same sentence never added anything, so one check per sentence
+    if len(lexicon_set.names) == 1:
+        return lexicon_set.names if lexicon_set.matcher.has_token(tokens) else []
+    return lexicon_set.hits(tokens)
+
+
+def nltk_chunks(corpus, f, lexicon_set, sent_window):
+    '''{name: chunks} of fileid f from NLTK sentences, token lists joined back up with spaces'''
+    #Files with no lexicon entry in the raw text get empty chunk files without being split into sentences
+    sentences = corpus.sents(f) if lexicon_set.matcher.prefilter(corpus.raw(f)) else []
+    hits = {name: [] for name in lexicon_set.names}
     for i,sen in enumerate(sentences):
-        for word in sen:
-            if word.lower() in lex:
-                #Get the window of sentences
-                upper = min(i+sent_window+1, n_sents)
-                if i <= last_up:
-                    lower = last_up
-                    chunk = [' '.join(s) for s in sentences[lower:upper]]
-                    #Get last chunk and add to end of it
-                    chunks[-1] += ''.join(chunk)
-                else:
-                    lower = max(i-sent_window,0)
-                    #Flatten into list of sentence strings
-                    chunk = [' '.join(s) for s in sentences[lower:upper]]
-                    chunk.append('\n')
-                    #Add to chunks but flatten list into 1 string
-                    chunks.append('. '.join(chunk))
-                last_up = upper
-    #Dump the sentence chunks to a file
-    chunk_file = open(f[4:-4] + '_chunked.txt','w+')
-    #Flatten into one long string with newlines in between each chunk
-    chunks = '\n'.join(chunks)
-    #Dump to file
-    chunk_file.write(chunks)
-    chunk_file.close()
-    progress += 1
+        for name in _hit_names(lexicon_set, sen):
+            hits[name].append(i)
+    return {name: window_chunks(sentences, hits[name], sent_window) for name in lexicon_set.names}
+
+
+def chunk_intervals(hits, n_sents, sent_window):
+    '''
+    Sentence intervals [first, last) of the chunks around the hit sentences. A hit inside or
+    right after the previous window extends it, the same chunks window_chunks makes.
+    '''
+    intervals = []
+    for i in hits:
+        upper = min(i+sent_window+1, n_sents)
+        if intervals and i <= intervals[-1][1]:
+            intervals[-1][1] = upper
+        else:
+            intervals.append([max(i-sent_window,0), upper])
+    return intervals
+
+
+def hit_sentences(text, starts, ends, lexicon_set):
+    '''
+    {name: indices of the sentences with an entry of that lexicon}. Only the sentences a
+    match of the raw prefilter pattern touches get tokenized and checked.
+    '''
+    hits = {name: [] for name in lexicon_set.names}
+    candidates = set()
+    for match in lexicon_set.matcher.raw.finditer(text):
+        first = np.searchsorted(ends, match.start(), side='right')
+        last = np.searchsorted(starts, match.end(), side='left')
+        candidates.update(range(first, last))
+    for i in sorted(candidates):
+        for name in _hit_names(lexicon_set, token_pattern.findall(text, starts[i], ends[i])):
+            hits[name].append(i)
+    return hits
+
+
+def rule_chunk_spans(text, lexicon_set, sent_window):
+    '''{name: (start, end) character offsets of its chunks in text}, from the sentence offsets of sentence_split.py'''
+    if not lexicon_set.matcher.prefilter(text):
+        return {name: [] for name in lexicon_set.names}
+    starts, ends = sentence_spans(text)
+    hits = hit_sentences(text, starts, ends, lexicon_set)
+    return {name: [(starts[first], ends[last - 1]) for first, last in chunk_intervals(hits[name], len(starts), sent_window)]
+            for name in lexicon_set.names}
+
+
+def chunk_file(f, corpus, lexicon_set, chunk_dirs, sent_window, splitter='rules', output='text'):
+    '''
+    Writes the chunk file of fileid f for every lexicon (output 'text'), its offset index
+    (output 'index', see pmicalc/chunk_index.py) or both, and returns their paths
+    '''
+    paths = []
+    if splitter == 'rules':
+        source = str(corpus.abspath(f))
+        #Read as bytes and decoded here, so character offsets map straight onto byte offsets
+        with open(source, 'rb') as raw_file:
+            text = raw_file.read().decode('utf-8')
+        spans = rule_chunk_spans(text, lexicon_set, sent_window)
+        for name, d in chunk_dirs.items():
+            stem = os.path.join(d, f[4:-4] + '_chunked')
+            if output in ('text', 'both'):
+                paths.append(stem + '.txt')
+                #Every chunk is one slice of the original text, punctuation kept, with its whitespace
+                #runs (line breaks included) made single spaces so it stays on one line
+                write_chunks(paths[-1], [' '.join(text[start:end].split()) for start, end in spans[name]])
+            if output in ('index', 'both'):
+                offsets = byte_offsets(text, [o for span in spans[name] for o in span])
+                paths.append(stem + '.idx')
+                write_file_index(paths[-1], source, zip(offsets[0::2], offsets[1::2]))
+        return paths
+    chunks = nltk_chunks(corpus, f, lexicon_set, sent_window)
+    for name, d in chunk_dirs.items():
+        paths.append(os.path.join(d, f[4:-4] + '_chunked.txt'))
+        write_chunks(paths[-1], chunks[name])
+    return paths
+
+
+#Set once per worker by the pool initializer
+_corpus = None
+_lexicon_set = None
+_chunk_dirs = None
+_sent_window = None
+_splitter = None
+_output = None
+
+
+def _init_worker(corpus_root, lexicons, chunk_dirs, sent_window, splitter, output):
+    global _corpus, _lexicon_set, _chunk_dirs, _sent_window, _splitter, _output
+    _corpus = PlaintextCorpusReader(corpus_root, '.*txt', word_tokenizer=RegexpTokenizer(token_reg))
+    _lexicon_set = lexicons
+    _chunk_dirs = chunk_dirs
+    _sent_window = sent_window
+    _splitter = splitter
+    _output = output
+
+
+def _chunk_task(f):
+    return chunk_file(f, _corpus, _lexicon_set, _chunk_dirs, _sent_window, _splitter, _output)
+
 
+if __name__ == '__main__':
+    #Variables that specify where the data is - Set for antiviral words in 2019
+    data_dir = '/newdata'
+    data_folder = '10-19_DATA_CLEAN_2021'
+    output_dir = '/newdata/2021_Chunked_Files'
+    file_type = '10KQ'
+    #Named lexicons chunked in the same pass, {name: csv path}, e.g. {'covid': '../../outputs/core_lexicon.csv',
+    #'supply_chain': 'supply_chain.csv'}. Phrases (words joined by spaces or _) match consecutive tokens.
+    #Every lexicon gets its chunk files in output_dir/<name>. None chunks core_lexicon.csv alone into output_dir.
+    lexicons = None
+    sent_window = 2
+    #'rules' cuts chunks out of the original text at the sentence offsets of pmicalc/sentence_split.py,
+    #'nltk' joins NLTK's sentence token lists back up like the first chunk runs did
+    sentence_splitter = 'rules'
+    #'text' writes <filing>_chunked.txt, 'index' only the (source, byte start, byte end) of every chunk in
+    #<filing>_chunked.idx for pmicalc/chunk_index.py to read the text back from, 'both' writes both.
+    #The index needs the 'rules' splitter.
+    chunk_output = 'text'
+    processes = os.cpu_count()
+    #Manifest of finished files and progress.json (throughput, ETA). Rerunning after a crash or
+    #kill skips the files already done, as long as the settings above stay the same.
+    run_dir = os.path.join(output_dir, 'chunk_run')
 
+    if chunk_output != 'text' and sentence_splitter != 'rules':
+        raise ValueError("chunk_output '" + chunk_output + "' needs sentence_splitter 'rules'")
+    lexicon_set = read_lexicons(lexicons)
+    print('lexicon loaded')
+    print(f'Current lexicon: {lexicon_set.terms}')
+    chunk_dirs = {name: output_dir if name is None else os.path.join(output_dir, name) for name in lexicon_set.names}
+    for d in chunk_dirs.values():
+        os.makedirs(d, exist_ok=True)
 
+    corpus_root = os.path.join(data_dir, data_folder)
+    files = PlaintextCorpusReader(corpus_root, '.*txt').fileids()
+    #files = list(pd.read_csv('/data/antiviral_2019_data.csv').File)
+    print('corpus loaded')
 
+    #Scan each file
+    # OOOOXOXOOXOXOOOOXOO -> OO(OOXOXOOXOXOO)(OOXOO)
+    settings = {'corpus': corpus_root, 'sent_window': sent_window, 'splitter': sentence_splitter, 'output': chunk_output,
+                'lexicons': {str(name): sorted(terms) for name, terms in lexicon_set.terms.items()},
+                'chunk_dirs': {str(name): d for name, d in chunk_dirs.items()}}
+    manager = RunManager(run_dir, settings)
+    manager.run(files, _chunk_task, processes, _init_worker, (corpus_root, lexicon_set, chunk_dirs, sent_window, sentence_splitter, chunk_output))
@@ -0,0 +1,109 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from lex_prop import folder_year, proportions_frame, read_lexicon, write_proportions
+from pmicalc.cooccurrence import csr_columns
+from pmicalc.lexicon_matcher import LexiconMatcher
+
+'''
+What-if lexicon proportions: the same tables lex_prop.py writes, computed from the document
+term matrix vocab_gen.py saves (sparse_matrix_<file_type>.npz, one row per filing in the
+order of files_<file_type>.txt) instead of from the raw text, so an edited lexicon can be
+tried in seconds.
+
+A filing's TokenCount is its row sum over the token vocabulary (the vocabulary lex_prop.py
+counts with, every column of the matrix if none is given) and its lexicon counts are the
+matrix columns of the lexicon words. The matrix only has single words, so phrases in the
+lexicon come out as zero columns, and vocab_gen.py leaves the stop words out of it.
+'''
+
+
+class LexiconEvaluator:
+    '''The document term matrix of a vocab_gen.py run, loaded once to evaluate many lexicons'''
+
+    def __init__(self, output_dir, file_type, token_vocab=None):
+        self.matrix = scipy.sparse.load_npz(os.path.join(output_dir, 'sparse_matrix_' + file_type + '.npz')).tocsr()
+        self.vocab = list(np.load(os.path.join(output_dir, 'vocab_filtered_' + file_type + '.npz'))['vocabulary'])
+        with open(os.path.join(output_dir, 'files_' + file_type + '.txt')) as file_list:
+            self.paths = file_list.read().split('\n')
+        if len(self.paths) != self.matrix.shape[0] or len(self.vocab) != self.matrix.shape[1]:
+            raise ValueError('sparse_matrix_' + file_type + '.npz does not match its file list and vocabulary')
+        self.word_map = {w: i for i, w in enumerate(self.vocab)}
+        if token_vocab is None:
+            counted = np.ones(len(self.vocab), dtype=bool)
+        else:
+            counted = np.zeros(len(self.vocab), dtype=bool)
+            missing = [w for w in token_vocab if w not in self.word_map]
+            if missing:
+                print(str(len(missing)) + ' words of the token vocabulary are not in the matrix and are not counted')
+            counted[[self.word_map[w] for w in token_vocab if w in self.word_map]] = True
+        self.counted = counted
+        self.token_counts = np.asarray(self.matrix @ counted.astype(np.int64)).ravel()
+        #Row labels like lex_prop.py's: the path within the year folder (10K/<file>.txt)
+        self.files = [os.path.relpath(p, os.path.dirname(os.path.dirname(p))) for p in self.paths]
+
+    def lexicon_counts(self, lexicon):
+        '''(distinct entries, files x entries counts) for lexicon, in LexiconMatcher order'''
+        matcher = LexiconMatcher(lexicon, verbatim=True)
+        terms = matcher.split
+        columns = [self.word_map[w[0]] if len(w) == 1 and w[0] in self.word_map and self.counted[self.word_map[w[0]]] else -1
+                   for w in terms]
+        phrases = sum(len(w) > 1 for w in terms)
+        if phrases:
+            print(str(phrases) + ' phrases in the lexicon cannot be counted from the matrix and stay at zero')
+        counts = np.zeros((self.matrix.shape[0], len(terms)), dtype=np.int64)
+        kept = [j for j, c in enumerate(columns) if c >= 0]
+        if kept:
+            #Read out of the CSR matrix as it is, a CSC copy would double the memory
+            counts[:, kept] = csr_columns(self.matrix, [columns[j] for j in kept]).T
+        return matcher.terms, counts
+
+    def proportions(self, lexicon, rows=None):
+        '''
+        The lex_prop.py proportions frame for lexicon, over the filings at rows (indices into
+        self.paths, all of them if None)
+        '''
+        unique, counts = self.lexicon_counts(lexicon)
+        rows = np.arange(len(self.paths)) if rows is None else np.asarray(rows)
+        files = [self.files[i] for i in rows]
+        return proportions_frame(files, self.token_counts[rows], counts[rows], lexicon, unique)
+
+    def word_summary(self, lexicon):
+        '''How many filings have every lexicon entry and how often it occurs in all, most frequent first'''
+        unique, counts = self.lexicon_counts(lexicon)
+        return pd.DataFrame({'word': unique, 'filings': (counts > 0).sum(axis=0),
+                             'count': counts.sum(axis=0)}).sort_values('count', ascending=False, ignore_index=True)
+
+    def years(self):
+        '''Rows of every year folder, keyed by its 10KQ_<year> file type, in file order'''
+        groups = {}
+        for i, p in enumerate(self.paths):
+            year = folder_year(os.path.dirname(os.path.dirname(p)))
+            groups.setdefault('10KQ_' + year, []).append(i)
+        return groups
+
+
+if __name__ == '__main__':
+    #Directory with the vocab_gen.py outputs, the tables go here too
+    output_dir = '/newdata'
+    file_type = '10KQ_11-7'
+    #Lexicon to try out
+    lexicon_path = 'lexicon.csv'
+    #csv, parquet, feather or dta (see lex_prop.py)
+    output_format = 'csv'
+
+    lexicon = read_lexicon(lexicon_path)
+    #lex_prop.py only counts the words of this vocabulary
+    token_vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    start = time.time()
+    evaluator = LexiconEvaluator(output_dir, file_type, token_vocab)
+    print('Matrix loaded in ' + str(round(time.time() - start, 1)) + 's')
+    start = time.time()
+    print(evaluator.word_summary(lexicon).head(20))
+    os.chdir(output_dir)
+    for year_type, rows in evaluator.years().items():
+        df_counts = evaluator.proportions(lexicon, rows)
+        write_proportions(df_counts, 'Lexicon_Proportions_Total_' + year_type + '_whatif', output_format)
+    print('Proportions written in ' + str(round(time.time() - start, 1)) + 's')
@@ -12,6 +12,9 @@ from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 import math
 import pickle
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.freq_table import FreqTable
 
 '''
 This file generates a vocabulary to use for analysis and a dictionary that will let
@@ -45,6 +48,8 @@ del corpus
 os.chdir(output_dir)
 np.savez('vocab_filtered_'+file_type,vocabulary=vocab)
 pickle.dump(freq_dist ,open('freqdist_'+file_type+'.pkl','wb'))
+#Named apart from vocab_gen.py's freqtable_10KQ_11-7, this is the June 2020 corpus only
+FreqTable.from_dict(freq_dist).save('freqtable_2020_since_june_'+file_type)
 
 
  
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer, token_reg
+
+'''
+On-disk store for co-occurrence matrices and frequency arrays.
+
+Every artifact is a directory of plain .npy files, which np.load can memory-map, plus a
+meta.json describing what it was counted from:
+    co-occurrence   data.npy, indices.npy, indptr.npy (the CSR components)
+    frequencies     counts.npy and vocab.npy (fixed-width strings, so it maps too)
+meta.json has the vocabulary hash and size, the window size, the file manifest (path and
+size of every filing counted), the tokenizer settings and, for seed rows, the seed words.
+Loading with a vocabulary checks its hash and refuses a mismatch, so a matrix can never be
+read against the wrong word ids.
+'''
+
+
+def vocab_hash(vocab):
+    sha = hashlib.sha1()
+    for w in vocab:
+        sha.update(str(w).encode('utf-8') + b'\n')
+    return sha.hexdigest()
+
+
+def file_manifest(files):
+    return [[f, os.path.getsize(f)] for f in files]
+
+
+def tokenizer_settings(tokenizer=default_tokenizer):
+    if tokenizer == 'whitespace':
+        return {'split': 'whitespace', 'lowercase': True}
+    return {'token_reg': token_reg, 'lowercase': True}
+
+
+def write_streamed(path, meta, write):
+    '''
+    Writes an artifact whose arrays are too big to hold at once: write(tmp_dir) puts the
+    .npy files into a temporary directory itself, which is renamed into place at the end
+    '''
+    tmp = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    write(tmp)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def _write_dir(path, arrays, meta):
+    def write(tmp):
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+    write_streamed(path, meta, write)
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        return json.load(meta_file)
+
+
+def _check_vocab(path, meta, vocab):
+    if vocab is not None and meta['vocab_hash'] != vocab_hash(vocab):
+        raise ValueError(path + ' was counted with a different vocabulary (' + str(meta['vocab_size'])
+                         + ' words) than the one given (' + str(len(vocab)) + ' words)')
+
+
+def matrix_meta(shape, dtype, vocab, window, files, seeds=None, kind='co_occurrence', tokenizer=default_tokenizer):
+    return {'kind': kind, 'shape': list(shape), 'dtype': str(dtype),
+            'vocab_hash': vocab_hash(vocab), 'vocab_size': len(vocab), 'window': window,
+            'seeds': None if seeds is None else list(seeds),
+            'files': file_manifest(files), 'tokenizer': tokenizer_settings(tokenizer)}
+
+
+def save_matrix(path, matrix, vocab, window, files, seeds=None, kind='co_occurrence', tokenizer=default_tokenizer):
+    '''
+    Saves a sparse co-occurrence matrix (the upper half, or seed rows when seeds, the seed
+    words, are given) with its provenance
+    '''
+    matrix = matrix.tocsr()
+    meta = matrix_meta(matrix.shape, matrix.dtype, vocab, window, files, seeds, kind, tokenizer)
+    _write_dir(path, {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr}, meta)
+
+
+def load_matrix(path, vocab=None, mmap=True):
+    '''
+    Returns (csr_matrix, meta). With mmap the CSR arrays stay memory-mapped and read only,
+    so opening is instant whatever the size. Raises ValueError if vocab does not match.
+    '''
+    meta = read_meta(path)
+    _check_vocab(path, meta, vocab)
+    mode = 'r' if mmap else None
+    data, indices, indptr = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+                             for name in ('data', 'indices', 'indptr')]
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False), meta
+
+
+def matches(path, vocab, window, files, seeds=None, tokenizer=default_tokenizer):
+    '''Whether path holds a matrix counted with exactly these settings and files'''
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return False
+    meta = read_meta(path)
+    return (meta['vocab_hash'] == vocab_hash(vocab) and meta['window'] == window
+            and meta['seeds'] == (None if seeds is None else list(seeds))
+            and meta['files'] == file_manifest(files) and meta['tokenizer'] == tokenizer_settings(tokenizer))
+
+
+def save_frequencies(path, freqs, vocab, files=None):
+    '''Saves a frequency array aligned with vocab, and vocab itself'''
+    meta = {'kind': 'frequencies', 'vocab_hash': vocab_hash(vocab), 'vocab_size': len(vocab),
+            'files': None if files is None else file_manifest(files), 'tokenizer': tokenizer_settings()}
+    vocab_array = np.asarray(vocab, dtype=str) if len(vocab) else np.zeros(0, dtype='<U1')
+    _write_dir(path, {'counts': np.asarray(freqs, dtype=np.int64), 'vocab': vocab_array}, meta)
+
+
+def load_frequencies(path, vocab=None, mmap=True):
+    meta = read_meta(path)
+    _check_vocab(path, meta, vocab)
+    return np.load(os.path.join(path, 'counts.npy'), mmap_mode='r' if mmap else None), meta
@@ -0,0 +1,111 @@
+import mmap
+import os
+from collections import OrderedDict
+import pandas as pd
+
+'''
+Chunk offset index: where every passage of the chunk files sits in its cleaned filing, so
+stages that only pass passage ids around never copy the text, and the text of any passage
+can still be read back on demand.
+
+lexicon_chunking.py with chunk_output 'index' writes, next to (or instead of) every
+<filing>_chunked.txt, a <filing>_chunked.idx with one line per chunk:
+    source filing path \t byte start \t byte end
+Line k is chunk k, the same chunk as line k of the text file, so its identifier is
+<filing>_chunked.txt-k, the way fix_chunks.py names them. A chunk's text is the bytes
+start..end of the source decoded as UTF-8 with its whitespace runs made single spaces,
+exactly the line the text file has.
+
+An index over many chunk files is a header-less TSV like fix_chunks.py's, with the
+columns in index_columns instead of Identifier, Filename and Text.
+'''
+
+index_columns = ['Identifier', 'Filename', 'Source', 'Start', 'End']
+
+
+def byte_offsets(text, offsets):
+    '''UTF-8 byte offsets of the character offsets (in increasing order) into text'''
+    out, last, position = [], 0, 0
+    for offset in offsets:
+        position += len(text[last:offset].encode('utf-8'))
+        last = offset
+        out.append(position)
+    return out
+
+
+def passage_text(data):
+    #Same clean up the chunk text files get
+    return ' '.join(data.decode('utf-8').split())
+
+
+def write_file_index(path, source, spans):
+    '''Writes the .idx of one chunk file: spans are the (byte start, byte end) of its chunks in source'''
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as index_file:
+        index_file.write(''.join(source + '\t' + str(start) + '\t' + str(end) + '\n' for start, end in spans))
+    os.replace(tmp, path)
+
+
+def read_file_index(path):
+    '''Index rows (index_columns) of one .idx file'''
+    filename = os.path.basename(path)[:-len('.idx')] + '.txt'
+    rows = []
+    with open(path) as index_file:
+        for k, line in enumerate(index_file):
+            source, start, end = line.rstrip('\n').split('\t')
+            rows.append((filename + '-' + str(k), filename, source, int(start), int(end)))
+    return rows
+
+
+def chunk_dir_index(d):
+    '''Index of every .idx file in the chunk directory d, in os.listdir order like fix_chunks.py'''
+    rows = [row for name in os.listdir(d) if name.endswith('.idx') for row in read_file_index(os.path.join(d, name))]
+    return pd.DataFrame(rows, columns=index_columns)
+
+
+def read_index(path):
+    return pd.read_csv(path, sep='\t', header=None, names=index_columns, dtype={'Start': 'int64', 'End': 'int64'})
+
+
+class ChunkReader:
+    '''Reads passage text from the source filings through memory maps, max_open of them at a time'''
+
+    def __init__(self, index, max_open=64):
+        '''index is an index frame (index_columns) or the path of an index TSV'''
+        self.index = read_index(index) if isinstance(index, str) else index
+        self.rows = {identifier: i for i, identifier in enumerate(self.index['Identifier'])}
+        self.max_open = max_open
+        self._maps = OrderedDict()
+
+    def _map(self, source):
+        if source in self._maps:
+            self._maps.move_to_end(source)
+            return self._maps[source]
+        with open(source, 'rb') as source_file:
+            data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(source) else b''
+        self._maps[source] = data
+        if len(self._maps) > self.max_open:
+            _, old = self._maps.popitem(last=False)
+            if isinstance(old, mmap.mmap):
+                old.close()
+        return data
+
+    def text(self, identifier):
+        i = self.rows[identifier]
+        source, start, end = self.index['Source'].iat[i], self.index['Start'].iat[i], self.index['End'].iat[i]
+        return passage_text(self._map(source)[start:end])
+
+    def texts(self, identifiers):
+        '''Texts of several passages, in the order given, read grouped by source so each file is mapped once'''
+        identifiers = list(identifiers)
+        order = sorted(range(len(identifiers)), key=lambda j: self.index['Source'].iat[self.rows[identifiers[j]]])
+        texts = [None] * len(identifiers)
+        for j in order:
+            texts[j] = self.text(identifiers[j])
+        return texts
+
+    def close(self):
+        for data in self._maps.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+        self._maps.clear()
@@ -0,0 +1,316 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, triu
+
+from pmicalc.corpus import default_tokenizer, read_tokens
+
+'''
+Windowed co-occurrence counting on integer token ids.
+
+A file of L tokens has L - window + 1 windows of `window` consecutive tokens. Like the
+old 20-gram loop, every window adds x^T x to the matrix, where x counts the vocabulary
+words in that window. Instead of building every window we walk the token pairs by
+distance d < window and weight each pair by the number of windows that hold both tokens,
+which gives the same totals. The matrix is symmetric so only the upper half (row <= col)
+is stored.
+
+PMI only ever reads the rows of the seed words, so there is also a seed mode that keeps
+just those rows (|seeds| x V) and never holds anything V x V.
+
+The pairs come out grouped by distance, and a pair's weight for any window size only
+depends on its distance and position, so one walk over the pairs up to the largest
+distance can fill the matrices for several window sizes at once (the multi-window mode).
+'''
+
+int32_max = np.iinfo(np.int32).max
+
+
+def vocab_index(vocab):
+    return {w: i for i, w in enumerate(vocab)}
+
+
+def token_ids(tokens, word_map):
+    #Words outside the vocabulary get -1 but still take up a position in the window
+    return np.fromiter((word_map.get(t, -1) for t in tokens), dtype=np.int64, count=len(tokens))
+
+
+def file_ids(f, word_map, cache=None, tokenizer=default_tokenizer):
+    '''
+    Token ids of a file, from the token cache when there is one instead of the raw text.
+    tokenizer is one of corpus.tokenizers, the cache only holds 'regex' tokens.
+    '''
+    if cache is None:
+        return token_ids(read_tokens(f, tokenizer), word_map)
+    if tokenizer != 'regex':
+        raise ValueError('The token cache holds regex tokens, it cannot be used with the ' + tokenizer + ' tokenizer')
+    return cache.vocab_ids(f, word_map)
+
+
+def window_pairs(ids, window=20, only=None):
+    '''
+    Takes the token id array of one file and returns (rows, cols, weights) for every
+    in-vocabulary token pair that shares a window, with rows <= cols. Pairs can repeat,
+    the caller sums them. If only (a boolean array over the vocabulary) is given, just
+    the pairs touching one of those words are returned.
+    '''
+    n = len(ids)
+    #Start of the last full window
+    last = n - window
+    rows, cols, weights = [], [], []
+    if last < 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    pos = np.arange(n, dtype=np.int64)
+    for d in range(window):
+        p = pos[:n - d]
+        #Windows starting in [max(0, q - window + 1), min(p, last)] contain both p and q = p + d
+        w = np.minimum(p, last) - np.maximum(0, p + d - window + 1) + 1
+        a = ids[:n - d]
+        b = ids[d:]
+        keep = (a >= 0) & (b >= 0) & (w > 0)
+        if only is not None:
+            keep &= only[np.maximum(a, 0)] | only[np.maximum(b, 0)]
+        a, b, w = a[keep], b[keep], w[keep]
+        if d > 0:
+            #x^T x adds both (a, b) and (b, a), which land on the same diagonal cell when a == b
+            w = np.where(a == b, 2 * w, w)
+        rows.append(np.minimum(a, b))
+        cols.append(np.maximum(a, b))
+        weights.append(w)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def count_ids(ids, v_size, window=20):
+    rows, cols, weights = window_pairs(ids, window)
+    return coo_matrix((weights, (rows, cols)), shape=(v_size, v_size), dtype=np.int64).tocsr()
+
+
+def sum_parts(parts, n_rows, n_cols=None):
+    '''Adds a list of sparse count matrices in one go instead of one at a time'''
+    if n_cols is None:
+        n_cols = n_rows
+    if not parts:
+        return csr_matrix((n_rows, n_cols), dtype=np.int64)
+    parts = [p.tocoo() for p in parts]
+    data = np.concatenate([p.data.astype(np.int64) for p in parts])
+    rows = np.concatenate([p.row for p in parts])
+    cols = np.concatenate([p.col for p in parts])
+    return coo_matrix((data, (rows, cols)), shape=(n_rows, n_cols)).tocsr()
+
+
+def downcast(co_occ):
+    #Counts are accumulated in int64, only go back to int32 when nothing would wrap around
+    if co_occ.nnz == 0 or co_occ.data.max() <= int32_max:
+        co_occ.data = co_occ.data.astype(np.int32)
+    else:
+        print('Largest count ' + str(co_occ.data.max()) + ' does not fit in int32, keeping int64')
+    return co_occ
+
+
+def count_files(files, word_map, v_size, window=20, batch_size=200, progress=True, cache=None,
+                tokenizer=default_tokenizer):
+    '''
+    Counts the windowed co-occurrences of every file into one upper triangular csr_matrix
+    (int64). Per-file matrices are summed in batches of batch_size files.
+    '''
+    co_occ = csr_matrix((v_size, v_size), dtype=np.int64)
+    parts = []
+    count = len(files)
+    for i, f in enumerate(files):
+        if progress and i % 500 == 0:
+            print('Co-occurrences for ' + f + ' : ' + str(i) + '/' + str(count))
+        parts.append(count_ids(file_ids(f, word_map, cache, tokenizer), v_size, window))
+        if len(parts) == batch_size:
+            co_occ = co_occ + sum_parts(parts, v_size)
+            parts = []
+    return co_occ + sum_parts(parts, v_size)
+
+
+def generate_co_occurrence_matrix(files, vocab, window=20, batch_size=200, cache=None,
+                                  tokenizer=default_tokenizer):
+    '''
+    Takes the list of filings and the vocabulary and returns the upper triangular
+    co-occurrence matrix (csr_matrix) and the word -> index map. cache is an optional
+    TokenCache to read the token ids from, tokenizer one of corpus.tokenizers.
+    '''
+    word_map = vocab_index(vocab)
+    co_occ = count_files(files, word_map, len(vocab), window, batch_size, cache=cache, tokenizer=tokenizer)
+    return downcast(co_occ), word_map
+
+
+def _to_seed_rows(rows, cols, weights, seed_row, v_size):
+    #Pair (a, b) lands in row a if a is a seed and in row b if b is a seed, a == b only once
+    row_a, row_b = seed_row[rows], seed_row[cols]
+    from_a = row_a >= 0
+    from_b = (row_b >= 0) & (rows != cols)
+    out_rows = np.concatenate([row_a[from_a], row_b[from_b]])
+    out_cols = np.concatenate([cols[from_a], rows[from_b]])
+    out_weights = np.concatenate([weights[from_a], weights[from_b]])
+    n_seeds = int(seed_row.max()) + 1
+    return coo_matrix((out_weights, (out_rows, out_cols)), shape=(n_seeds, v_size), dtype=np.int64).tocsr()
+
+
+def count_seed_ids(ids, seed_row, v_size, window=20):
+    '''
+    Seed rows of the full matrix for one file. seed_row maps a vocabulary id to its row
+    in the output, or -1 for words that are not seeds.
+    '''
+    rows, cols, weights = window_pairs(ids, window, only=seed_row >= 0)
+    return _to_seed_rows(rows, cols, weights, seed_row, v_size)
+
+
+def seed_row_map(seeds, v_size):
+    '''Maps every vocabulary id to its row among the distinct seeds, -1 for other words'''
+    unique_seeds = list(dict.fromkeys(seeds))
+    seed_row = np.full(v_size, -1, dtype=np.int64)
+    seed_row[unique_seeds] = np.arange(len(unique_seeds))
+    return seed_row
+
+
+def count_seed_files(files, word_map, seed_row, v_size, window=20, batch_size=200, progress=True, cache=None,
+                     tokenizer=default_tokenizer):
+    '''Seed mode version of count_files, one row per distinct seed (int64)'''
+    n_seeds = int(seed_row.max()) + 1
+    co_occ = csr_matrix((n_seeds, v_size), dtype=np.int64)
+    parts = []
+    count = len(files)
+    for i, f in enumerate(files):
+        if progress and i % 500 == 0:
+            print('Seed co-occurrences for ' + f + ' : ' + str(i) + '/' + str(count))
+        parts.append(count_seed_ids(file_ids(f, word_map, cache, tokenizer), seed_row, v_size, window))
+        if len(parts) == batch_size:
+            co_occ = co_occ + sum_parts(parts, n_seeds, v_size)
+            parts = []
+    return co_occ + sum_parts(parts, n_seeds, v_size)
+
+
+def expand_seed_rows(co_occ, seeds, seed_row):
+    #Repeated seeds get repeated rows
+    return co_occ[seed_row[list(seeds)], :]
+
+
+def generate_seed_co_occurrence_matrix(files, vocab, seeds, window=20, batch_size=200, progress=True, cache=None,
+                                       tokenizer=default_tokenizer):
+    '''
+    Takes the list of filings, the vocabulary and a list of seed word ids and returns a
+    len(seeds) x V csr_matrix whose row i is row seeds[i] of the full co-occurrence
+    matrix, so the same numbers symmetrize(generate_co_occurrence_matrix(...)) would give
+    '''
+    word_map = vocab_index(vocab)
+    seed_row = seed_row_map(seeds, len(vocab))
+    co_occ = count_seed_files(files, word_map, seed_row, len(vocab), window, batch_size, progress, cache, tokenizer)
+    return downcast(expand_seed_rows(co_occ, seeds, seed_row)), word_map
+
+
+def multi_window_pairs(ids, windows, only=None):
+    '''
+    window_pairs for several window sizes from one walk over the pairs up to distance
+    max(windows). Returns rows, cols and a len(windows) x n_pairs weights array, where
+    weights[k] is what window_pairs(ids, windows[k]) gives the pair (0 if it does not fit).
+    '''
+    n = len(ids)
+    windows = np.asarray(windows, dtype=np.int64)
+    rows, cols, weights = [], [], []
+    pos = np.arange(n, dtype=np.int64)
+    for d in range(min(int(windows.max()), n)):
+        p = pos[:n - d]
+        a = ids[:n - d]
+        b = ids[d:]
+        keep = (a >= 0) & (b >= 0)
+        if only is not None:
+            keep &= only[np.maximum(a, 0)] | only[np.maximum(b, 0)]
+        p, a, b = p[keep], a[keep], b[keep]
+        #Same window count as in window_pairs, once per window size
+        last = (n - windows)[:, None]
+        w = np.minimum(p[None, :], last) - np.maximum(0, p[None, :] + d - windows[:, None] + 1) + 1
+        w = np.where(windows[:, None] > d, np.maximum(w, 0), 0)
+        if d > 0:
+            w = np.where(a == b, 2 * w, w)
+        used = w.any(axis=0)
+        rows.append(np.minimum(a, b)[used])
+        cols.append(np.maximum(a, b)[used])
+        weights.append(w[:, used])
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros((len(windows), 0), dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights, axis=1)
+
+
+def count_multi_window_ids(ids, v_size, windows, seed_row=None):
+    '''One matrix per window size for one file, seed rows only when seed_row is given'''
+    only = None if seed_row is None else seed_row >= 0
+    rows, cols, weights = multi_window_pairs(ids, windows, only)
+    if seed_row is None:
+        return [coo_matrix((w, (rows, cols)), shape=(v_size, v_size), dtype=np.int64).tocsr() for w in weights]
+    return [_to_seed_rows(rows, cols, w, seed_row, v_size) for w in weights]
+
+
+def generate_multi_window_co_occurrence_matrix(files, vocab, windows=(5, 10, 20, 50), seeds=None,
+                                               batch_size=200, progress=True, cache=None,
+                                               tokenizer=default_tokenizer):
+    '''
+    Counts several window sizes in one pass over the files. Returns a dict from window
+    size to the matrix generate_co_occurrence_matrix (or, with seeds,
+    generate_seed_co_occurrence_matrix) would give for it, and the word -> index map.
+    '''
+    word_map = vocab_index(vocab)
+    v_size = len(vocab)
+    windows = list(windows)
+    seed_row = None if seeds is None else seed_row_map(seeds, v_size)
+    n_rows = v_size if seeds is None else int(seed_row.max()) + 1
+    co_occ = [csr_matrix((n_rows, v_size), dtype=np.int64) for w in windows]
+    parts = []
+    count = len(files)
+    for i, f in enumerate(files):
+        if progress and i % 500 == 0:
+            print('Co-occurrences for windows ' + str(windows) + ', ' + f + ' : ' + str(i) + '/' + str(count))
+        parts.append(count_multi_window_ids(file_ids(f, word_map, cache, tokenizer), v_size, windows, seed_row))
+        if len(parts) == batch_size or i == count - 1:
+            co_occ = [total + sum_parts([p[k] for p in parts], n_rows, v_size) for k, total in enumerate(co_occ)]
+            parts = []
+    if seeds is not None:
+        co_occ = [expand_seed_rows(m, seeds, seed_row) for m in co_occ]
+    return {w: downcast(m) for w, m in zip(windows, co_occ)}, word_map
+
+
+def symmetrize(upper):
+    '''Full symmetric matrix from the stored upper half'''
+    upper = upper.tocsr()
+    return (upper + triu(upper, k=1).T).tocsr()
+
+
+def csr_columns(matrix, ids, block=2 ** 24):
+    '''
+    Columns of a CSR matrix for the given ids as a dense len(ids) x n_rows array. Every
+    stored entry is still read, but the indices (and the data of the hits) are streamed
+    block entries at a time without converting the matrix, so a memory-mapped one stays
+    mapped and memory stays bounded by the block and the output, unlike tocsc().
+    '''
+    ids = np.asarray(ids, dtype=np.int64)
+    unique, inverse = np.unique(ids, return_inverse=True)
+    position = np.full(matrix.shape[1], -1, dtype=np.int64)
+    position[unique] = np.arange(len(unique))
+    columns = np.zeros((len(unique), matrix.shape[0]), dtype=np.int64)
+    indptr = np.asarray(matrix.indptr)
+    for start in range(0, matrix.nnz, block):
+        end = min(start + block, matrix.nnz)
+        k = position[matrix.indices[start:end]]
+        hit = np.flatnonzero(k >= 0)
+        rows = np.searchsorted(indptr, start + hit, side='right') - 1
+        np.add.at(columns, (k[hit], rows), np.asarray(matrix.data[start:end])[hit])
+    return columns[inverse]
+
+
+def seed_rows(upper, seed_ids):
+    '''
+    Rows of the full matrix for the given word ids as a dense len(seed_ids) x V array,
+    read straight from the upper half: row s is U[s, s:] joined with U[:s, s]. The seed
+    rows are sliced out and the columns streamed with csr_columns, so a memory-mapped
+    matrix is never copied whole.
+    '''
+    upper = upper.tocsr()
+    seed_ids = np.asarray(seed_ids, dtype=np.int64)
+    right = upper[seed_ids, :].toarray().astype(np.int64)
+    #Column s of the upper half holds U[j, s] for j <= s, drop j == s so the diagonal only counts once
+    below = csr_columns(upper, seed_ids)
+    below[np.arange(len(seed_ids)), seed_ids] = 0
+    return right + below
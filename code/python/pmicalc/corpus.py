@@ -0,0 +1,52 @@
+import os
+import regex as re
+
+'''
+Shared corpus settings for the pmicalc scripts: where the cleaned filings live and
+how they are split into tokens.
+
+Every stage counts with default_tokenizer, 'regex': vocab_gen.py's token pattern, the one
+the vocabulary, the frequency tables and the token cache are made with, so all of them see
+identical tokens. 'whitespace' is what the old 20-gram loops in pmi_fast.py and
+pmi_no_timer.py did, raw_file.read().split() with every token lowercased, so punctuation
+stays attached (covid-19, is not covid-19). Only those two scripts offer it, as an opt-in
+to reproduce old results.
+'''
+
+#Folder the year/form folders live in
+data_dir = '/newdata'
+#Year/form folders that make up the 2019-2021 10-K/10-Q corpus
+data_folders = ['10-19_DATA_CLEAN_2019/10K', '10-19_DATA_CLEAN_2019/10Q',
+                '10-19_DATA_CLEAN_2020/10K2', '10-19_DATA_CLEAN_2020/10Q',
+                '10-19_DATA_CLEAN_2021/10K', '10-19_DATA_CLEAN_2021/10Q']
+
+#Same token pattern vocab_gen.py hands to CountVectorizer
+token_reg = r"[A-Za-z]+-[A-Za-z]+-[0-9]|[a-zA-Z0-9]+-[a-zA-Z0-9]+|[a-zA-Z0-9]+"
+token_pattern = re.compile(token_reg)
+
+
+def list_files(folders=data_folders, root=data_dir):
+    '''
+    Full paths of every filing in the given folders, sorted within each folder so
+    runs see the files in the same order every time
+    '''
+    return [os.path.join(root, d, f) for d in folders for f in sorted(os.listdir(os.path.join(root, d)))]
+
+
+def tokenize(text):
+    #Lowercase first and then match, which is what CountVectorizer does
+    return token_pattern.findall(text.lower())
+
+
+def split_tokens(text):
+    #The old co-occurrence loops: split on whitespace, then lowercase every token
+    return [w.lower() for w in text.split()]
+
+
+tokenizers = {'regex': tokenize, 'whitespace': split_tokens}
+default_tokenizer = 'regex'
+
+
+def read_tokens(path, tokenizer=default_tokenizer):
+    with open(path, 'r', encoding='utf-8') as raw_file:
+        return tokenizers[tokenizer](raw_file.read())
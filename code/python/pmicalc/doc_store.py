@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import list_files
+from pmicalc.cooccurrence import count_seed_ids, file_ids, seed_row_map, vocab_index
+from pmicalc.artifacts import file_manifest, read_meta, tokenizer_settings, vocab_hash, write_streamed
+from pmicalc.pmi import pmi_scores, top_k
+from pmicalc.token_cache import TokenCache
+
+'''
+Per-filing co-occurrence store, so PMI can be computed for any subset of the filings, or
+any bootstrap resample of them, without reading the text again.
+
+For every filing it keeps
+    seed_counts   its seed-row co-occurrence vector: c_w over that one file, summed over
+                  the seed list (repeats included, like the seed rows pmi_fast.py uses)
+    term_counts   its count of every vocabulary word
+as rows of two files x V sparse matrices. Since all of PMI's inputs are sums over files,
+a set of files given as a weight per file (0/1 for a subset, how often it was drawn for a
+bootstrap resample) gets c_w = weights @ seed_counts, n_w = weights @ term_counts,
+N = sum(n_w) and C = the sum of n_w over the seeds.
+'''
+
+_word_map = None
+_seed_row = None
+_seed_weights = None
+_cache = None
+
+
+def _init_worker(vocab, seeds, cache_dir):
+    global _word_map, _seed_row, _seed_weights, _cache
+    _word_map = vocab_index(vocab)
+    _seed_row = seed_row_map(seeds, len(vocab))
+    #How many times every distinct seed is in the list, in seed_row order
+    _seed_weights = np.bincount(_seed_row[list(seeds)], minlength=int(_seed_row.max()) + 1)
+    _cache = None if cache_dir is None else TokenCache(cache_dir)
+
+
+def _count_batch(task):
+    batch, window = task
+    v_size = len(_word_map)
+    seed_parts, term_parts = [], []
+    for f in batch:
+        ids = file_ids(f, _word_map, _cache)
+        rows = count_seed_ids(ids, _seed_row, v_size, window)
+        seed_parts.append(scipy.sparse.csr_matrix(_seed_weights @ rows))
+        term_parts.append(scipy.sparse.csr_matrix(np.bincount(ids[ids >= 0], minlength=v_size).reshape(1, -1)))
+    return (scipy.sparse.vstack(seed_parts, format='csr', dtype=np.int64),
+            scipy.sparse.vstack(term_parts, format='csr', dtype=np.int64))
+
+
+def doc_info(files):
+    '''Year, form type and CIK of every filing, read off the folder layout and file name'''
+    #The last four digit number in the folder path is the year (10-19_DATA_CLEAN_2020)
+    years = [re.findall(r'\d{4}', os.path.dirname(f)) for f in files]
+    return pd.DataFrame({'file': files,
+                         'year': [int(y[-1]) if y else -1 for y in years],
+                         #10K2 is the second batch of 2020 10-Ks, still 10-Ks
+                         'form': [re.sub(r'(10[KQ]).*', r'\1', os.path.basename(os.path.dirname(f))) for f in files],
+                         'CIK': [os.path.basename(f).split('-')[0] for f in files]})
+
+
+def build_doc_store(files, vocab, seeds, path, window=20, processes=1, batch_size=100, cache_dir=None):
+    '''
+    Counts the per-filing seed vectors and term counts of files and saves them at path.
+    seeds are vocabulary ids, repeats allowed.
+    '''
+    vocab = list(vocab)
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    tasks = [(batch, window) for batch in batches]
+    if processes > 1:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(processes, initializer=_init_worker, initargs=(vocab, seeds, cache_dir)) as pool:
+            results = []
+            for i, result in enumerate(pool.imap(_count_batch, tasks)):
+                results.append(result)
+                if (i + 1) % 10 == 0:
+                    print('Counted ' + str(i + 1) + '/' + str(len(tasks)) + ' batches')
+    else:
+        _init_worker(vocab, seeds, cache_dir)
+        results = []
+        for i, task in enumerate(tasks):
+            print('Counting batch ' + str(i) + '/' + str(len(tasks)))
+            results.append(_count_batch(task))
+    empty = scipy.sparse.csr_matrix((0, len(vocab)), dtype=np.int64)
+    seed_counts = scipy.sparse.vstack([r[0] for r in results], format='csr') if results else empty
+    term_counts = scipy.sparse.vstack([r[1] for r in results], format='csr') if results else empty
+    meta = {'kind': 'doc_store', 'vocab_hash': vocab_hash(vocab), 'vocab_size': len(vocab), 'window': window,
+            'seeds': [vocab[s] for s in seeds], 'files': file_manifest(files), 'tokenizer': tokenizer_settings()}
+
+    def write(tmp):
+        for name, matrix in (('seed_counts', seed_counts), ('term_counts', term_counts)):
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(tmp, name + '_' + part + '.npy'), getattr(matrix, part))
+
+    write_streamed(path, meta, write)
+
+
+class DocStore:
+    '''A saved per-filing store, memory-mapped'''
+
+    def __init__(self, path, vocab):
+        meta = read_meta(path)
+        if meta['vocab_hash'] != vocab_hash(vocab):
+            raise ValueError(path + ' was counted with a different vocabulary than the one given')
+        self.meta = meta
+        self.vocab = np.asarray(vocab)
+        self.files = [f for f, size in meta['files']]
+        self.info = doc_info(self.files)
+        word_map = vocab_index(vocab)
+        self.seeds = np.array([word_map[w] for w in meta['seeds']], dtype=np.int64)
+        shape = (len(self.files), len(vocab))
+        for name in ('seed_counts', 'term_counts'):
+            data, indices, indptr = [np.load(os.path.join(path, name + '_' + part + '.npy'), mmap_mode='r')
+                                     for part in ('data', 'indices', 'indptr')]
+            setattr(self, name, scipy.sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False))
+
+    def weights(self, mask=None):
+        '''Per-file weights from a boolean mask over the files (e.g. from self.info), all files if None'''
+        return np.ones(len(self.files)) if mask is None else np.asarray(mask, dtype=np.float64)
+
+    def scores(self, weights, min_count=1):
+        '''PMI of every vocabulary word over the files weighted by weights'''
+        c_w = self.seed_counts.T @ weights
+        n_w = self.term_counts.T @ weights
+        return pmi_scores(c_w.reshape(1, -1), n_w, n_w.sum(), n_w[self.seeds].sum(), min_count)
+
+    def pmi(self, mask=None, k=1000, min_count=1):
+        '''PMI table like pmi_fast.py writes, over the files where mask is true'''
+        scores = self.scores(self.weights(mask), min_count)
+        best = top_k(scores, k)
+        return pd.DataFrame({'word': self.vocab[best], 'pmi': scores[best]})
+
+    def bootstrap(self, n_boot=200, k=1000, mask=None, min_count=1, ci=0.95, seed=0):
+        '''
+        Resamples the files (those where mask is true) with replacement n_boot times and
+        returns the top k words of the full sample with the mean, standard deviation and
+        ci confidence interval of their PMI over the resamples, and how often they made
+        the top k
+        '''
+        rng = np.random.default_rng(seed)
+        base = self.weights(mask)
+        chosen = np.flatnonzero(base)
+        words = top_k(self.scores(base, min_count), k)
+        samples = np.full((n_boot, len(words)), np.nan)
+        in_top = np.zeros(len(words))
+        for b in range(n_boot):
+            weights = np.zeros(len(self.files))
+            np.add.at(weights, rng.choice(chosen, size=len(chosen)), 1)
+            scores = self.scores(weights, min_count)
+            samples[b] = scores[words]
+            in_top += np.isin(words, top_k(scores, k))
+        low, high = np.nanquantile(samples, [(1 - ci) / 2, (1 + ci) / 2], axis=0)
+        return pd.DataFrame({'word': self.vocab[words], 'pmi': self.scores(base, min_count)[words],
+                             'mean': np.nanmean(samples, axis=0), 'std': np.nanstd(samples, axis=0),
+                             'low': low, 'high': high, 'top_k_share': in_top / n_boot})
+
+
+if __name__ == '__main__':
+    #Directory with the vocab from vocab_gen.py, output goes here too
+    output_dir = '/newdata'
+    file_type = '10KQ'
+    window = 20
+    word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
+    processes = os.cpu_count()
+    #Token cache made by token_cache.py, None reads and tokenizes the raw files
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    v_index = vocab_index(vocab)
+    seeds = [v_index[w] for w in word_list if w in v_index]
+    store_path = 'doc_store_' + file_type
+    if not os.path.exists(os.path.join(store_path, 'meta.json')):
+        build_doc_store(files, vocab, seeds, store_path, window, processes, cache_dir=cache_dir)
+    store = DocStore(store_path, vocab)
+    for form in ('10K', '10Q'):
+        store.pmi(store.info['form'] == form).to_csv('pmi_' + form + '_docs.csv')
+    for year in sorted(store.info['year'].unique()):
+        store.pmi(store.info['year'] == year).to_csv('pmi_' + str(year) + '_docs.csv')
+    df_boot = store.bootstrap(200, 100)
+    print(df_boot.head(20))
+    df_boot.to_csv('pmi_bootstrap_' + file_type + '.csv')
@@ -0,0 +1,219 @@
+import os
+import shutil
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer, list_files
+from pmicalc.cooccurrence import file_ids, int32_max, vocab_index, window_pairs
+from pmicalc.artifacts import matrix_meta, write_streamed
+from pmicalc.token_cache import TokenCache
+
+'''
+Out-of-core co-occurrence counting for vocabularies whose V x V matrix does not fit in memory.
+
+Pairs are encoded as one int64 key, row * V + col, so sorting keys sorts the matrix in CSR
+order. Keys and weights from the files are buffered and, once the buffer reaches the
+memory budget, summed up and written to run_dir as a sorted run (two raw int64 files,
+.keys and .counts). The runs are then combined by an external k-way merge: every step
+reads the next block of each run through a memory map, takes everything up to the
+smallest last key among the blocks (nothing later in any run can be smaller), and
+sums it. More runs than fan_in are first merged into bigger runs, so only fan_in blocks
+are ever held at once. The last merge streams straight into the CSR arrays of an
+artifacts.py matrix directory, which load_matrix can memory-map.
+'''
+
+#Bytes per buffered pair: the key and weight plus room for sorting them
+bytes_per_pair = 48
+
+
+def _reduce(keys, counts):
+    '''Sorts keys and adds up the counts of repeated ones'''
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    if len(keys) == 0:
+        return keys, counts
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def _write_run(path, keys, counts):
+    for suffix, array in (('.keys', keys), ('.counts', counts)):
+        tmp = path + suffix + '.tmp'
+        array.astype(np.int64).tofile(tmp)
+        os.replace(tmp, path + suffix)
+    return path
+
+
+def _open_run(path):
+    return (np.memmap(path + '.keys', dtype=np.int64, mode='r') if os.path.getsize(path + '.keys') else np.zeros(0, dtype=np.int64),
+            np.memmap(path + '.counts', dtype=np.int64, mode='r') if os.path.getsize(path + '.counts') else np.zeros(0, dtype=np.int64))
+
+
+def _remove_run(path):
+    os.remove(path + '.keys')
+    os.remove(path + '.counts')
+
+
+def merge_runs(runs, block):
+    '''
+    Yields (keys, counts) chunks with every key once and in increasing order, summed over
+    all the runs. At most block entries of every run are read at a time.
+    '''
+    opened = [_open_run(r) for r in runs]
+    pos = [0] * len(opened)
+    while True:
+        live = [i for i, (keys, _) in enumerate(opened) if pos[i] < len(keys)]
+        if not live:
+            return
+        #Every run still has keys above the smallest block end, so up to it nothing is missing
+        cutoff = min(opened[i][0][min(pos[i] + block, len(opened[i][0])) - 1] for i in live)
+        key_parts, count_parts = [], []
+        for i in live:
+            keys, counts = opened[i]
+            end = pos[i] + np.searchsorted(keys[pos[i]:min(pos[i] + block, len(keys))], cutoff, side='right')
+            key_parts.append(np.asarray(keys[pos[i]:end]))
+            count_parts.append(np.asarray(counts[pos[i]:end]))
+            pos[i] = end
+        yield _reduce(np.concatenate(key_parts), np.concatenate(count_parts))
+
+
+def spill_runs(files, word_map, v_size, run_dir, window=20, memory_budget_mb=2048, cache=None, progress=True,
+               tokenizer=default_tokenizer):
+    '''
+    Counts the files into sorted runs in run_dir and returns their paths. A run is written
+    whenever the buffered pairs, after adding up repeats, would go over memory_budget_mb.
+    '''
+    os.makedirs(run_dir, exist_ok=True)
+    budget = max(int(memory_budget_mb * 2 ** 20) // bytes_per_pair, 1)
+    runs = []
+    key_parts, count_parts, buffered = [], [], 0
+    for i, f in enumerate(files):
+        if progress and i % 500 == 0:
+            print('Co-occurrences for ' + f + ' : ' + str(i) + '/' + str(len(files)) + ', ' + str(len(runs)) + ' runs spilled')
+        rows, cols, weights = window_pairs(file_ids(f, word_map, cache, tokenizer), window)
+        key_parts.append(rows * v_size + cols)
+        count_parts.append(weights)
+        buffered += len(rows)
+        if buffered < budget:
+            continue
+        keys, counts = _reduce(np.concatenate(key_parts), np.concatenate(count_parts))
+        if len(keys) < budget // 2:
+            #Repeats took care of most of it, keep going in memory
+            key_parts, count_parts, buffered = [keys], [counts], len(keys)
+            continue
+        runs.append(_write_run(os.path.join(run_dir, 'run_00_{:05d}'.format(len(runs))), keys, counts))
+        key_parts, count_parts, buffered = [], [], 0
+    if key_parts:
+        keys, counts = _reduce(np.concatenate(key_parts), np.concatenate(count_parts))
+        runs.append(_write_run(os.path.join(run_dir, 'run_00_{:05d}'.format(len(runs))), keys, counts))
+    return runs
+
+
+def _merge_levels(runs, run_dir, block, fan_in):
+    #Merges groups of fan_in runs into single runs until at most fan_in are left
+    level = 0
+    while len(runs) > fan_in:
+        level += 1
+        merged = []
+        for j in range(0, len(runs), fan_in):
+            group = runs[j:j + fan_in]
+            path = os.path.join(run_dir, 'run_{:02d}_{:05d}'.format(level, j // fan_in))
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            with open(path + '.keys.tmp', 'wb') as key_file, open(path + '.counts.tmp', 'wb') as count_file:
+                for keys, counts in merge_runs(group, block):
+                    keys.tofile(key_file)
+                    counts.tofile(count_file)
+            os.replace(path + '.keys.tmp', path + '.keys')
+            os.replace(path + '.counts.tmp', path + '.counts')
+            for r in group:
+                _remove_run(r)
+            merged.append(path)
+        runs = merged
+        print('Merge level ' + str(level) + ': ' + str(len(runs)) + ' runs left')
+    return runs
+
+
+def _write_csr(tmp, runs, v_size, block):
+    #First pass writes column ids and counts to flat files and counts entries per row
+    row_nnz = np.zeros(v_size, dtype=np.int64)
+    nnz, largest = 0, 0
+    with open(os.path.join(tmp, 'indices.raw'), 'wb') as index_file, open(os.path.join(tmp, 'data.raw'), 'wb') as data_file:
+        for keys, counts in merge_runs(runs, block):
+            row_nnz += np.bincount(keys // v_size, minlength=v_size)
+            (keys % v_size).tofile(index_file)
+            counts.tofile(data_file)
+            nnz += len(keys)
+            largest = max(largest, int(counts.max()) if len(counts) else 0)
+    #Then they are copied block by block into .npy files with their final dtypes
+    index_dtype = np.int32 if max(nnz, v_size) <= int32_max else np.int64
+    data_dtype = np.int32 if largest <= int32_max else np.int64
+    indptr = np.lib.format.open_memmap(os.path.join(tmp, 'indptr.npy'), mode='w+', dtype=index_dtype, shape=(v_size + 1,))
+    indptr[0] = 0
+    np.cumsum(row_nnz, out=indptr[1:])
+    indptr.flush()
+    for name, dtype in (('indices', index_dtype), ('data', data_dtype)):
+        raw_path = os.path.join(tmp, name + '.raw')
+        out = np.lib.format.open_memmap(os.path.join(tmp, name + '.npy'), mode='w+', dtype=dtype, shape=(nnz,))
+        if nnz:
+            raw = np.memmap(raw_path, dtype=np.int64, mode='r')
+            for start in range(0, nnz, block):
+                out[start:start + block] = raw[start:start + block]
+            del raw
+        out.flush()
+        del out
+        os.remove(raw_path)
+    return nnz, data_dtype
+
+
+def external_co_occurrence_matrix(files, vocab, path, run_dir, window=20, memory_budget_mb=2048,
+                                  fan_in=16, cache=None, keep_runs=False, tokenizer=default_tokenizer):
+    '''
+    Counts the upper triangular co-occurrence matrix of files without ever holding it in
+    memory and saves it as an artifacts.py matrix at path (open it with load_matrix).
+    Same counts as generate_co_occurrence_matrix. cache is an optional TokenCache,
+    tokenizer one of corpus.tokenizers.
+    '''
+    vocab = list(vocab)
+    v_size = len(vocab)
+    if v_size * v_size > np.iinfo(np.int64).max:
+        raise ValueError('Vocabulary of ' + str(v_size) + ' words is too big for int64 pair keys')
+    runs = spill_runs(files, vocab_index(vocab), v_size, run_dir, window, memory_budget_mb, cache, tokenizer=tokenizer)
+    print(str(len(runs)) + ' runs spilled to ' + run_dir)
+    #Every merge step holds one block per run, together inside the budget
+    block = max(int(memory_budget_mb * 2 ** 20) // (bytes_per_pair * (fan_in + 1)), 1)
+    runs = _merge_levels(runs, run_dir, block, fan_in)
+    meta = matrix_meta((v_size, v_size), np.int64, vocab, window, files, tokenizer=tokenizer)
+
+    def write(tmp):
+        #The data dtype is only known after the merge, meta.json is written after this returns
+        nnz, dtype = _write_csr(tmp, runs, v_size, block)
+        meta['dtype'] = str(np.dtype(dtype))
+        print('Saved ' + str(nnz) + ' non-zero counts to ' + path)
+
+    write_streamed(path, meta, write)
+    if not keep_runs:
+        for r in runs:
+            _remove_run(r)
+        if not os.listdir(run_dir):
+            shutil.rmtree(run_dir)
+    return path
+
+
+if __name__ == '__main__':
+    #Directory the vocab from vocab_gen.py is in and where the matrix is written
+    output_dir = '/newdata'
+    run_dir = '/newdata/co_occ_runs'
+    file_type = '10KQ'
+    window = 20
+    memory_budget_mb = 4096
+    #Token cache from token_cache.py, None tokenizes the raw text
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    vocab = np.load('vocab_final_11-8.npz')['vocabulary']
+    cache = None if cache_dir is None else TokenCache(cache_dir)
+    external_co_occurrence_matrix(files, vocab, 'co_occ_matrix_' + file_type, run_dir, window, memory_budget_mb, cache=cache)
@@ -0,0 +1,94 @@
+import os
+import pickle
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.artifacts import load_frequencies, save_frequencies
+
+'''
+Frequency table to use instead of the pickled freqdist dict: a sorted vocabulary array
+and the counts lined up with it. It is saved with artifacts.save_frequencies as two .npy
+files, so loading is a pair of memory maps instead of unpickling a huge dict, and totals
+like N and C are array sums. It answers `word in table`, table[word] and table.get(word)
+like the dict did.
+'''
+
+
+class FreqTable:
+
+    def __init__(self, vocab, counts):
+        vocab = np.asarray(vocab, dtype=str) if len(vocab) else np.zeros(0, dtype='<U1')
+        counts = np.asarray(counts, dtype=np.int64)
+        order = np.argsort(vocab, kind='stable')
+        if not np.array_equal(order, np.arange(len(vocab))):
+            vocab, counts = vocab[order], counts[order]
+        self.vocab = vocab
+        self.counts = counts
+        self._index = None
+
+    @classmethod
+    def from_dict(cls, freq_dist):
+        return cls(list(freq_dist), np.fromiter(freq_dist.values(), dtype=np.int64, count=len(freq_dist)))
+
+    @classmethod
+    def load(cls, path):
+        counts, meta = load_frequencies(path)
+        table = cls.__new__(cls)
+        table.vocab = np.load(os.path.join(path, 'vocab.npy'), mmap_mode='r')
+        table.counts = counts
+        table._index = None
+        return table
+
+    def save(self, path, files=None):
+        save_frequencies(path, self.counts, self.vocab, files)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def index(self, word):
+        '''Id of a word, -1 if it is not in the table. The dict behind it is built on first use'''
+        if self._index is None:
+            self._index = {w: i for i, w in enumerate(self.vocab.tolist())}
+        return self._index.get(word, -1)
+
+    def ids(self, words):
+        '''Ids of many words at once with a binary search over the sorted vocabulary, -1 for missing ones'''
+        words = np.asarray(words, dtype=str) if len(words) else np.zeros(0, dtype='<U1')
+        if len(self.vocab) == 0:
+            return np.full(len(words), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.vocab, words), len(self.vocab) - 1)
+        return np.where(self.vocab[pos] == words, pos, -1)
+
+    def __contains__(self, word):
+        return self.index(word) >= 0
+
+    def __getitem__(self, word):
+        i = self.index(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.counts[i]
+
+    def get(self, word, default=None):
+        i = self.index(word)
+        return default if i < 0 else self.counts[i]
+
+    def aligned(self, vocab):
+        '''Counts in the order of another vocabulary, 0 for words the table does not have'''
+        ids = self.ids(vocab)
+        return np.where(ids >= 0, self.counts[np.maximum(ids, 0)], 0) if len(ids) else np.zeros(0, dtype=np.int64)
+
+    def total(self, words=None):
+        '''Sum of the counts of words (repeats count again), or of the whole table'''
+        if words is None:
+            return self.counts.sum()
+        ids = self.ids(words)
+        return self.counts[ids[ids >= 0]].sum()
+
+
+def load_freq_dist(path, pickle_path):
+    '''The FreqTable saved at path, or one made from the legacy freqdist pickle if there is none yet'''
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return FreqTable.load(path)
+    with open(pickle_path, 'rb') as pickle_file:
+        return FreqTable.from_dict(pickle.load(pickle_file))
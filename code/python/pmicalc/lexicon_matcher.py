@@ -0,0 +1,158 @@
+import regex as re
+import numpy as np
+
+'''
+One compiled matcher for a lexicon, shared by lex_prop.py, lexicon_chunking.py and the
+earnings call filter.
+
+A lexicon entry is a word or a multiword phrase (words separated by spaces or underscores).
+All entries are folded into a single character trie that is written out as one regular
+expression, so the regex engine walks every position once against all entries at the
+same time instead of trying them one after another. The same trie gives three patterns:
+    exact      whole tokens, in text made of tokens joined by single spaces
+    substring  anywhere, also inside longer tokens
+    prefilter  anywhere in raw text, phrase words separated by any non-token characters,
+               so a document that fails it cannot have an exact or phrase match
+Counting is done on arrays of word ids instead, every entry on its own, so a word inside a
+matched phrase still counts for the word as well.
+
+LexiconSet puts several named lexicons into one matcher over all their entries, so one
+pass over the text counts them all and the counts are split up per lexicon afterwards.
+'''
+
+#What can separate the words of a phrase in raw text
+raw_separator = r'[^A-Za-z0-9]+'
+
+
+def split_term(term):
+    return tuple(re.split(r'[\s_]+', term.strip()))
+
+
+def distinct_terms(lexicon, ignore_case=True, verbatim=False):
+    '''
+    Distinct entries in lexicon order, blanks dropped. Entries are stripped (and lowercased
+    with ignore_case), unless verbatim: then they are kept as written, the way a lookup of
+    lowercased tokens sees them, and one with spaces around it (or capitals, with
+    ignore_case) can never match and is left out.
+    '''
+    if verbatim:
+        return list(dict.fromkeys(t for t in lexicon if t.strip() and t == t.strip() and (not ignore_case or t == t.lower())))
+    return list(dict.fromkeys(t.strip().lower() if ignore_case else t.strip() for t in lexicon if t.strip()))
+
+
+def _trie_pattern(terms, separator):
+    '''Regular expression matching any of terms (tuples of words), built from a trie so shared prefixes are tried once'''
+    trie = {}
+    for words in terms:
+        node = trie
+        for atom in [c for c in words[0]] + [a for w in words[1:] for a in (None,) + tuple(w)]:
+            node = node.setdefault(atom, {})
+        node[''] = {}
+
+    def write(node):
+        end = '' in node
+        branches = [(separator if atom is None else re.escape(atom)) + write(child)
+                    for atom, child in sorted(node.items(), key=lambda item: (item[0] is None, item[0] or '')) if atom != '']
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 and not end else '(?:' + '|'.join(branches) + ')'
+        #Longer entries win over their prefixes because the optional group is greedy
+        return body + '?' if end else body
+
+    return write(trie)
+
+
+class LexiconMatcher:
+
+    def __init__(self, lexicon, ignore_case=True, verbatim=False):
+        self.ignore_case = ignore_case
+        self.terms = distinct_terms(lexicon, ignore_case, verbatim)
+        self.split = [split_term(t) for t in self.terms]
+        flags = re.IGNORECASE if ignore_case else 0
+        alternation = _trie_pattern(self.split, ' ') if self.terms else '(?!)'
+        self.exact = re.compile(r'(?<!\S)' + alternation + r'(?!\S)', flags)
+        self.substring = re.compile(alternation, flags)
+        self.raw = re.compile(_trie_pattern(self.split, raw_separator) if self.terms else '(?!)', flags)
+        #Ids over just the words of the entries, for counting plain token lists
+        self.word_map = {w: i for i, w in enumerate(dict.fromkeys(w for words in self.split for w in words))}
+        self.columns, self.phrases = self.vocab_columns(self.word_map)
+
+    def prefilter(self, text):
+        '''False when text cannot contain any entry, checked on the raw text before tokenizing'''
+        return self.raw.search(text) is not None
+
+    def has_token(self, tokens):
+        '''Whether the token list holds an entry as whole tokens (phrases as consecutive tokens)'''
+        return self.exact.search(' '.join(tokens)) is not None
+
+    def count_tokens(self, tokens):
+        '''Count of every distinct entry in a token list, in the order of self.terms'''
+        if self.ignore_case:
+            tokens = [t.lower() for t in tokens]
+        ids = np.fromiter((self.word_map.get(t, -1) for t in tokens), dtype=np.int64, count=len(tokens))
+        return self.count_ids(ids, self.columns, self.phrases)
+
+    def search_substring(self, text):
+        '''First place an entry shows up inside text, as a match object, or None'''
+        return self.substring.search(text)
+
+    def vocab_columns(self, word_map):
+        '''
+        For token id arrays: maps every vocabulary id to the column of its single word entry
+        (-1 for other words) and turns the phrases into tuples of ids. Entries with words
+        outside the vocabulary can never be counted and are left out.
+        '''
+        columns = np.full(len(word_map), -1, dtype=np.int64)
+        phrases = []
+        for j, words in enumerate(self.split):
+            if not all(w in word_map for w in words):
+                continue
+            if len(words) == 1:
+                columns[word_map[words[0]]] = j
+            else:
+                phrases.append((j, np.array([word_map[w] for w in words], dtype=np.int64)))
+        return columns, phrases
+
+    def count_ids(self, ids, columns, phrases):
+        '''
+        Count of every entry in an array of vocabulary ids (-1 for words outside it), using
+        vocab_columns. Phrases are matched on consecutive ids with one comparison per word.
+        '''
+        kept = ids[ids >= 0]
+        cols = columns[kept]
+        counts = np.bincount(cols[cols >= 0], minlength=len(self.terms))
+        for j, phrase in phrases:
+            n = len(ids) - len(phrase) + 1
+            if n <= 0:
+                continue
+            hit = np.ones(n, dtype=bool)
+            for k, w in enumerate(phrase):
+                hit &= ids[k:k + n] == w
+            counts[j] += int(hit.sum())
+        return counts
+
+
+class LexiconSet:
+    '''
+    Named lexicons ({name: entries}) matched together. self.matcher is one LexiconMatcher
+    over all their entries, an entry shared by several lexicons is counted once.
+    '''
+
+    def __init__(self, lexicons, ignore_case=True, verbatim=False):
+        self.names = list(lexicons)
+        self.matcher = LexiconMatcher([t for lexicon in lexicons.values() for t in lexicon], ignore_case, verbatim)
+        position = {t: j for j, t in enumerate(self.matcher.terms)}
+        #Distinct entries of every lexicon and where they are in self.matcher.terms
+        self.terms = {name: distinct_terms(lexicon, ignore_case, verbatim) for name, lexicon in lexicons.items()}
+        self.columns = {name: np.array([position[t] for t in terms], dtype=np.int64) for name, terms in self.terms.items()}
+
+    def split(self, counts):
+        '''Counts in self.matcher.terms order (along the last axis) split into {name: counts of that lexicon}'''
+        counts = np.asarray(counts)
+        return {name: counts[..., columns] for name, columns in self.columns.items()}
+
+    def hits(self, tokens):
+        '''Names of the lexicons with an entry in the token list, in self.names order'''
+        if not self.matcher.has_token(tokens):
+            return []
+        return [name for name, counts in self.split(self.matcher.count_tokens(tokens)).items() if counts.any()]
@@ -0,0 +1,224 @@
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.cooccurrence import int32_max, vocab_index
+from pmicalc.artifacts import load_matrix, read_meta, tokenizer_settings, vocab_hash, write_streamed
+from pmicalc.freq_table import load_freq_dist
+from pmicalc.pmi import freq_array
+
+'''
+Top-k PMI neighbours of every vocabulary word, so a lexicon for any theme can start from a
+lookup instead of another pass over the corpus.
+
+With one word w as the seed, the PMI of u is log10((c_wu / n_w) / (n_u / N)), the same
+formula as pmi.py with C = n_w. That is symmetric in w and u, so everything comes from the
+stored upper half of the full co-occurrence matrix. Rows are scored a block at a time: a
+block of the full matrix is the block of upper rows plus the same rows of the strictly
+lower part, its nonzeros are scored in one go and the best k of every row are picked by
+sorting on (row, -score). With ppmi negative scores are dropped. The strictly lower part
+(the upper half transposed, without the diagonal) is written to disk once by
+save_strict_lower, streaming the upper half, and memory-mapped like it.
+
+The table is saved like the other artifacts.py directories: indptr.npy (V + 1), ids.npy
+(int32 neighbour ids) and scores.npy (float32), row w being ids[indptr[w]:indptr[w + 1]].
+'''
+
+
+def _entry_rows(indptr, start, end):
+    #Row of every stored entry start .. end of a CSR matrix
+    return np.searchsorted(indptr, np.arange(start, end), side='right') - 1
+
+
+def save_strict_lower(upper, path, meta=None, block=2 ** 24):
+    '''
+    Saves the strictly lower part of the full matrix, the transpose of the upper half
+    without its diagonal, as an artifacts.py matrix at path (open it with load_matrix).
+    The upper half is read block entries at a time in two passes, one to count the entries
+    of every lower row and one to put them in place in memory-mapped arrays, so neither
+    matrix is ever held whole. meta is the upper half's, its provenance is kept.
+    '''
+    upper = upper.tocsr()
+    v_size = upper.shape[0]
+    indptr = np.asarray(upper.indptr)
+    lower_nnz = np.zeros(v_size, dtype=np.int64)
+    largest = 0
+    for start in range(0, upper.nnz, block):
+        end = min(start + block, upper.nnz)
+        cols = np.asarray(upper.indices[start:end], dtype=np.int64)
+        off = cols != _entry_rows(indptr, start, end)
+        lower_nnz += np.bincount(cols[off], minlength=v_size)
+        largest = max(largest, int(np.asarray(upper.data[start:end]).max()) if end > start else 0)
+    nnz = int(lower_nnz.sum())
+    index_dtype = np.int32 if max(nnz, v_size) <= int32_max else np.int64
+    data_dtype = np.int32 if largest <= int32_max else np.int64
+
+    def write(tmp):
+        lower_indptr = np.lib.format.open_memmap(os.path.join(tmp, 'indptr.npy'), mode='w+', dtype=index_dtype,
+                                                 shape=(v_size + 1,))
+        lower_indptr[0] = 0
+        np.cumsum(lower_nnz, out=lower_indptr[1:])
+        cursor = np.array(lower_indptr[:-1], dtype=np.int64)
+        lower_indptr.flush()
+        indices = np.lib.format.open_memmap(os.path.join(tmp, 'indices.npy'), mode='w+', dtype=index_dtype, shape=(nnz,))
+        data = np.lib.format.open_memmap(os.path.join(tmp, 'data.npy'), mode='w+', dtype=data_dtype, shape=(nnz,))
+        for start in range(0, upper.nnz, block):
+            end = min(start + block, upper.nnz)
+            rows = _entry_rows(indptr, start, end)
+            cols = np.asarray(upper.indices[start:end], dtype=np.int64)
+            off = cols != rows
+            #Stable, so within a lower row the entries stay in upper row order, which is column order there
+            order = np.argsort(cols[off], kind='stable')
+            rows, cols, values = rows[off][order], cols[off][order], np.asarray(upper.data[start:end])[off][order]
+            place = cursor[cols] + np.arange(len(cols)) - np.searchsorted(cols, cols)
+            indices[place] = rows
+            data[place] = values
+            cursor += np.bincount(cols, minlength=v_size)
+        indices.flush()
+        data.flush()
+        del lower_indptr, indices, data
+
+    meta = {} if meta is None else dict(meta)
+    meta.update({'kind': 'strict_lower', 'shape': [v_size, v_size], 'dtype': str(np.dtype(data_dtype))})
+    write_streamed(path, meta, write)
+    return path
+
+
+def _block_top_k(block, first, freqs, N, k, ppmi, min_count, min_co_occurrence, include_self):
+    #block holds full-matrix rows first .. first + block.shape[0], returns (row lengths, ids, scores)
+    block = block.tocsr()
+    block.sum_duplicates()
+    rows = np.repeat(np.arange(block.shape[0], dtype=np.int64), np.diff(block.indptr))
+    cols = block.indices.astype(np.int64)
+    counts = block.data.astype(np.float64)
+    n_w, n_u = freqs[first + rows].astype(np.float64), freqs[cols].astype(np.float64)
+    keep = (counts >= max(min_co_occurrence, 1)) & (n_w >= max(min_count, 1)) & (n_u >= max(min_count, 1))
+    if not include_self:
+        keep &= cols != first + rows
+    rows, cols, counts, n_w, n_u = rows[keep], cols[keep], counts[keep], n_w[keep], n_u[keep]
+    scores = np.log10(counts * N / (n_w * n_u))
+    if ppmi:
+        positive = scores > 0
+        rows, cols, scores = rows[positive], cols[positive], scores[positive]
+    #Best first within every row, ties in vocabulary order
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.searchsorted(rows, np.arange(block.shape[0]))
+    rank = np.arange(len(rows)) - starts[rows]
+    best = rank < k
+    return np.bincount(rows[best], minlength=block.shape[0]), cols[best], scores[best]
+
+
+def top_k_neighbours(upper, freqs, k=100, ppmi=False, min_count=1, min_co_occurrence=1,
+                     include_self=False, block_size=2048, progress=True, lower=None):
+    '''
+    Takes the upper triangular co-occurrence matrix and the aligned frequency array and
+    returns (indptr, ids, scores) with the k best neighbours of every word, best first.
+    lower is its save_strict_lower matrix, written to a temporary directory and removed
+    afterwards if not given. Only block_size rows of the full matrix are ever built at once.
+    '''
+    upper = upper.tocsr()
+    v_size = upper.shape[0]
+    freqs = np.asarray(freqs, dtype=np.int64)
+    N = float(freqs.sum())
+    tmp_dir = None
+    if lower is None:
+        tmp_dir = tempfile.mkdtemp()
+        lower, _ = load_matrix(save_strict_lower(upper, os.path.join(tmp_dir, 'lower')))
+    lengths, ids, scores = [], [], []
+    for first in range(0, v_size, block_size):
+        if progress and (first // block_size) % 10 == 0:
+            print('Neighbours for rows ' + str(first) + '/' + str(v_size))
+        last = min(first + block_size, v_size)
+        block = upper[first:last] + lower[first:last]
+        n, b_ids, b_scores = _block_top_k(block, first, freqs, N, k, ppmi, min_count, min_co_occurrence, include_self)
+        lengths.append(n)
+        ids.append(b_ids.astype(np.int32))
+        scores.append(b_scores.astype(np.float32))
+    if tmp_dir is not None:
+        del lower
+        shutil.rmtree(tmp_dir)
+    indptr = np.concatenate([[0], np.cumsum(np.concatenate(lengths) if lengths else [], dtype=np.int64)])
+    return (indptr, np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32))
+
+
+def save_neighbours(path, indptr, ids, scores, vocab, k, ppmi, matrix_meta=None):
+    meta = {'kind': 'neighbours', 'vocab_hash': vocab_hash(vocab), 'vocab_size': len(vocab), 'k': k, 'ppmi': ppmi,
+            'window': None if matrix_meta is None else matrix_meta['window'],
+            'files': None if matrix_meta is None else matrix_meta['files']}
+
+    def write(tmp):
+        for name, array in (('indptr', indptr), ('ids', ids), ('scores', scores)):
+            np.save(os.path.join(tmp, name + '.npy'), array)
+
+    write_streamed(path, meta, write)
+
+
+class NeighbourTable:
+    '''A saved neighbours table, memory-mapped, looked up by word'''
+
+    def __init__(self, path, vocab):
+        meta = read_meta(path)
+        if meta['vocab_hash'] != vocab_hash(vocab):
+            raise ValueError(path + ' was built with a different vocabulary than the one given')
+        self.meta = meta
+        self.vocab = np.asarray(vocab)
+        self.word_map = vocab_index(vocab)
+        self.indptr, self.ids, self.scores = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                                              for name in ('indptr', 'ids', 'scores')]
+
+    def neighbours(self, word, k=None):
+        '''DataFrame of word/pmi for the neighbours of word, best first'''
+        i = self.word_map[word]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return pd.DataFrame({'word': self.vocab[self.ids[start:end]], 'pmi': np.asarray(self.scores[start:end])})
+
+    def lookup(self, words, k=None):
+        '''Neighbours of several seed words stacked, with a seed column, skipping words not in the vocabulary'''
+        tables = [self.neighbours(w, k).assign(seed=w) for w in words if w in self.word_map]
+        if not tables:
+            return pd.DataFrame({'seed': [], 'word': [], 'pmi': []})
+        return pd.concat(tables, ignore_index=True)[['seed', 'word', 'pmi']]
+
+
+if __name__ == '__main__':
+    #Directory with the vocab, freq dist and full matrix (pmi_fast.py with seed_only = False)
+    output_dir = '/newdata'
+    file_type = '10KQ'
+    #Window the matrix has to have been counted with
+    window = 20
+    k = 100
+    ppmi = True
+    #Neighbours rarer than this are left out, they make for noisy PMI
+    min_count = 50
+
+    os.chdir(output_dir)
+    vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    freq_path = 'freqtable_10KQ_11-7'
+    freq_dist = load_freq_dist(freq_path, 'freqdist_10KQ_11-7.pkl')
+    X, meta = load_matrix('co_occ_matrix_' + file_type, vocab)
+    #Counts and frequencies have to come from the same tokens, the pickle is vocab_gen.py's regex ones
+    freq_tokenizer = tokenizer_settings()
+    if os.path.exists(os.path.join(freq_path, 'meta.json')):
+        freq_tokenizer = read_meta(freq_path)['tokenizer']
+    if meta['tokenizer'] != freq_tokenizer or meta['window'] != window:
+        raise ValueError('co_occ_matrix_' + file_type + ' was counted with ' + str(meta['tokenizer']) + ' and window '
+                         + str(meta['window']) + ', the frequencies with ' + str(freq_tokenizer) + ' and window '
+                         + str(window) + ' is wanted, count it again with pmi_fast.py')
+    #The transposed copy is written once and reused while the matrix stays the same
+    lower_path = 'co_occ_lower_' + file_type
+    stored = read_meta(lower_path) if os.path.exists(os.path.join(lower_path, 'meta.json')) else {}
+    if any(stored.get(key) != meta[key] for key in ('vocab_hash', 'window', 'files', 'tokenizer')):
+        save_strict_lower(X, lower_path, meta)
+    lower, _ = load_matrix(lower_path, vocab)
+    indptr, ids, scores = top_k_neighbours(X, freq_array(freq_dist, vocab), k, ppmi, min_count, lower=lower)
+    save_neighbours('neighbours_' + file_type, indptr, ids, scores, vocab, k, ppmi, meta)
+    table = NeighbourTable('neighbours_' + file_type, vocab)
+    print(table.lookup(['inflation', 'shortage', 'supply'], 10))
@@ -0,0 +1,160 @@
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer, list_files
+from pmicalc.cooccurrence import count_files, count_seed_files, downcast, expand_seed_rows, seed_row_map, vocab_index
+from pmicalc.token_cache import TokenCache
+from pmicalc.artifacts import save_matrix, vocab_hash
+
+'''
+Counts co-occurrences with a pool of worker processes.
+
+The file list is cut into shards of shard_size files. Every worker counts one shard into
+a partial sparse matrix and saves it to checkpoint_dir, then the partials are added up
+pairwise (a tree reduction), again in the pool, with every merged matrix also saved.
+A run that gets killed picks up from whatever checkpoints already exist: the shard
+assignment is kept in shards.json so a restart cuts the file list the same way. A restart
+with a different file list, window, seeds or vocabulary raises instead of reusing them.
+'''
+
+#Set once per worker by the pool initializer so the vocabulary is only sent over once
+_word_map = None
+_seed_row = None
+_cache = None
+_tokenizer = default_tokenizer
+
+
+def _init_worker(vocab, seeds, cache_dir, tokenizer):
+    global _word_map, _seed_row, _cache, _tokenizer
+    _word_map = vocab_index(vocab)
+    _seed_row = None if seeds is None else seed_row_map(seeds, len(vocab))
+    _cache = None if cache_dir is None else TokenCache(cache_dir)
+    _tokenizer = tokenizer
+
+
+def _save_atomic(path, matrix):
+    #Write under a temporary name and rename so a crash never leaves half a checkpoint
+    tmp = path[:-len('.npz')] + '.tmp.npz'
+    scipy.sparse.save_npz(tmp, matrix, compressed=False)
+    os.replace(tmp, path)
+
+
+def _count_shard(task):
+    path, files, window = task
+    if os.path.exists(path):
+        return path
+    v_size = len(_word_map)
+    if _seed_row is None:
+        co_occ = count_files(files, _word_map, v_size, window, progress=False, cache=_cache, tokenizer=_tokenizer)
+    else:
+        co_occ = count_seed_files(files, _word_map, _seed_row, v_size, window, progress=False, cache=_cache,
+                                  tokenizer=_tokenizer)
+    _save_atomic(path, co_occ)
+    return path
+
+
+def _merge_pair(task):
+    path, left, right = task
+    if not os.path.exists(path):
+        _save_atomic(path, scipy.sparse.load_npz(left) + scipy.sparse.load_npz(right))
+    return path
+
+
+def shard_files(files, shard_size):
+    return [files[i:i + shard_size] for i in range(0, len(files), shard_size)]
+
+
+def _load_manifest(checkpoint_dir, settings, files, shard_size):
+    '''Returns the shards to use, reusing the saved assignment when resuming'''
+    manifest_path = os.path.join(checkpoint_dir, 'shards.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['settings'] != settings:
+            raise ValueError('Checkpoints in ' + checkpoint_dir + ' were made with different settings: '
+                             + str(manifest['settings']) + ' vs ' + str(settings))
+        if [f for shard in manifest['shards'] for f in shard] != files:
+            raise ValueError('Checkpoints in ' + checkpoint_dir + ' were made from a different file list, '
+                             'remove them to count these files')
+        return manifest['shards']
+    shards = shard_files(files, shard_size)
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as manifest_file:
+        json.dump({'settings': settings, 'shards': shards}, manifest_file)
+    os.replace(tmp, manifest_path)
+    return shards
+
+
+def parallel_co_occurrence_matrix(files, vocab, checkpoint_dir, window=20, seeds=None,
+                                  processes=None, shard_size=500, keep_checkpoints=True, cache_dir=None,
+                                  tokenizer=default_tokenizer):
+    '''
+    Same result as generate_co_occurrence_matrix (or generate_seed_co_occurrence_matrix
+    when seeds is given) but spread over processes workers. Returns the matrix and the
+    word -> index map. With cache_dir the workers read token ids from that token cache,
+    otherwise they tokenize with tokenizer (one of corpus.tokenizers).
+    '''
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    vocab = list(vocab)
+    settings = {'window': window, 'v_size': len(vocab), 'vocab_hash': vocab_hash(vocab),
+                'seeds': None if seeds is None else [int(s) for s in seeds], 'tokenizer': tokenizer}
+    shards = _load_manifest(checkpoint_dir, settings, list(files), shard_size)
+    paths = [os.path.join(checkpoint_dir, 'shard_{:05d}.npz'.format(i)) for i in range(len(shards))]
+    done = sum(os.path.exists(p) for p in paths)
+    print(str(done) + '/' + str(len(shards)) + ' shards already counted')
+    written = []
+    #fork so the pmicalc scripts, which have no __main__ guard, are not re-run in the workers
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(vocab, seeds, cache_dir, tokenizer)) as pool:
+        tasks = [(p, shard, window) for p, shard in zip(paths, shards)]
+        for i, _ in enumerate(pool.imap_unordered(_count_shard, tasks)):
+            if (i + 1) % 10 == 0:
+                print('Counted ' + str(i + 1) + '/' + str(len(tasks)) + ' shards')
+        written += paths
+        #Tree reduction, an odd one out moves up to the next level unchanged
+        level = 0
+        while len(paths) > 1:
+            level += 1
+            tasks = [(os.path.join(checkpoint_dir, 'merge_{:02d}_{:05d}.npz'.format(level, i // 2)), paths[i], paths[i + 1])
+                     for i in range(0, len(paths) - 1, 2)]
+            merged = pool.map(_merge_pair, tasks)
+            if len(paths) % 2:
+                merged.append(paths[-1])
+            paths = merged
+            written += [t[0] for t in tasks]
+            print('Merge level ' + str(level) + ': ' + str(len(paths)) + ' matrices left')
+    word_map = vocab_index(vocab)
+    if paths:
+        co_occ = scipy.sparse.load_npz(paths[0]).tocsr()
+    else:
+        n_rows = len(vocab) if seeds is None else len(dict.fromkeys(seeds))
+        co_occ = scipy.sparse.csr_matrix((n_rows, len(vocab)), dtype=np.int64)
+    if seeds is not None:
+        co_occ = expand_seed_rows(co_occ, seeds, seed_row_map(seeds, len(vocab)))
+    if not keep_checkpoints:
+        for p in written:
+            os.remove(p)
+        os.remove(os.path.join(checkpoint_dir, 'shards.json'))
+    return downcast(co_occ), word_map
+
+
+if __name__ == '__main__':
+    #Directory the vocab from vocab_gen.py is in and where the matrix is written
+    output_dir = '/newdata'
+    checkpoint_dir = '/newdata/co_occ_shards'
+    file_type = '10KQ'
+    window = 20
+    processes = os.cpu_count()
+    #Token cache from token_cache.py, None tokenizes the raw text
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    vocab = np.load('vocab_final_11-8.npz')['vocabulary']
+    X, v_index = parallel_co_occurrence_matrix(files, vocab, checkpoint_dir, window, processes=processes, cache_dir=cache_dir)
+    save_matrix('co_occ_matrix_' + file_type, X, vocab, window, files)
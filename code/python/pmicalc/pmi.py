@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+'''
+Vectorized PMI scoring against a set of seed words.
+
+For every vocabulary word w with frequency n_w, c_w is its co-occurrence count summed
+over the seed rows and
+    pmi(w) = log10((c_w / C) / (n_w / N))
+where N is the total frequency of the vocabulary and C the total frequency of the seeds.
+Words that never co-occur with a seed get no score.
+'''
+
+
+def freq_array(freq_dist, vocab):
+    '''
+    Frequencies from the freqdist dict (or a FreqTable) lined up with the vocabulary, 0 for
+    missing words
+    '''
+    if hasattr(freq_dist, 'aligned'):
+        return freq_dist.aligned(vocab)
+    return np.fromiter((freq_dist.get(w, 0) for w in vocab), dtype=np.int64, count=len(vocab))
+
+
+def pmi_scores(seed_counts, freqs, N, C, min_count=1):
+    '''
+    Takes the seed rows of the co-occurrence matrix (dense or sparse, one row per seed),
+    the aligned frequency array and the N and C totals. Returns a float array with the
+    PMI of every vocabulary word, NaN where c_w is 0 or n_w is below min_count.
+    '''
+    c_w = np.asarray(seed_counts.sum(axis=0), dtype=np.float64).ravel()
+    n_w = np.asarray(freqs, dtype=np.float64)
+    scores = np.full(len(n_w), np.nan)
+    keep = (c_w != 0) & (n_w >= max(min_count, 1))
+    scores[keep] = np.log10((c_w[keep] / C) / (n_w[keep] / N))
+    return scores
+
+
+def top_k(scores, k=None):
+    '''
+    Indices of the k highest non-NaN scores, best first. Uses argpartition so only the
+    k winners get sorted; ties keep vocabulary order.
+    '''
+    valid = np.flatnonzero(~np.isnan(scores))
+    if k is not None and k < len(valid):
+        valid = valid[np.argpartition(-scores[valid], k - 1)[:k]]
+        valid.sort()
+    return valid[np.argsort(-scores[valid], kind='stable')]
+
+
+def pmi_table(seed_counts, freqs, vocab, N, C, k=None, min_count=1):
+    '''Top k words and their PMI as a DataFrame sorted by pmi, like calculate_pmi used to return'''
+    scores = pmi_scores(seed_counts, freqs, N, C, min_count)
+    best = top_k(scores, k)
+    return pd.DataFrame({'word': np.asarray(vocab)[best], 'pmi': scores[best]})
+
+
+def pmi_by_window(seed_counts_by_window, freqs, vocab, N, C, k=1000, min_count=1):
+    '''
+    Ranked lists for several window sizes next to each other, one word_<w>/pmi_<w> column
+    pair per window. Takes a dict from window size to that window's seed rows.
+    '''
+    columns = {}
+    for w, seed_counts in sorted(seed_counts_by_window.items()):
+        table = pmi_table(seed_counts, freqs, vocab, N, C, k, min_count)
+        columns['word_' + str(w)] = table['word']
+        columns['pmi_' + str(w)] = table['pmi']
+    return pd.DataFrame(columns)
@@ -5,78 +5,52 @@ from nltk import ngrams
 from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 import math
-import pickle
 import itertools
-from scipy.sparse import coo_matrix, dok_matrix
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer, list_files
+from pmicalc.cooccurrence import generate_co_occurrence_matrix, generate_seed_co_occurrence_matrix, generate_multi_window_co_occurrence_matrix, seed_rows, vocab_index
+from pmicalc.pmi import freq_array, pmi_table, pmi_by_window
+from pmicalc.parallel_count import parallel_co_occurrence_matrix
+from pmicalc.external_count import external_co_occurrence_matrix
+from pmicalc.token_cache import TokenCache
+from pmicalc.artifacts import load_matrix, matches, save_matrix
+from pmicalc.freq_table import load_freq_dist
 '''
 Generates a co-occurence matrix using the given data, vocabulary and frequency distribution
 '''
 
 #File path to where the folder that the data is in is.
-files = ['/newdata/10-19_DATA_CLEAN_2019/10K/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2019/10K')] + ['/newdata/10-19_DATA_CLEAN_2019/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2019/10Q')] + ['/newdata/10-19_DATA_CLEAN_2020/10K2/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2020/10K2')] + ['/newdata/10-19_DATA_CLEAN_2020/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2020/10Q')] + ['/newdata/10-19_DATA_CLEAN_2021/10K/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2021/10K')] + ['/newdata/10-19_DATA_CLEAN_2021/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2021/10Q')]
+files = list_files()
 #Directory where you want the data to be outputted, and where you saved the vocab and freq dist from vocab_gen.py
 output_dir = "/newdata"
 #Named based on what type of files you're looking a, either 10K's, 10Q's or combined (10KQ).
 file_type = '10KQ'
+#Number of consecutive tokens that count as co-occurring
+window = 20
+#Window sizes to count side by side in the same pass (seed rows only), None just counts window
+windows = None
+#Only count the seed rows (|seeds| x V) instead of the whole V x V matrix, PMI comes out the same
+seed_only = True
+#Worker processes for counting, 1 runs in this process. Shards are checkpointed in checkpoint_dir
+processes = 1
+checkpoint_dir = '/newdata/co_occ_shards'
+#Token cache made by token_cache.py, None reads and tokenizes the raw files
+cache_dir = None
+#How the raw files are split into tokens (see corpus.py), the same as every other stage by
+#default. 'whitespace' opts into the old 20-gram loop's split() and lowercase to reproduce
+#old tables; its matrices are only reused by runs with the same setting and it cannot read
+#the token cache
+tokenizer = default_tokenizer
+#Memory budget for counting the full matrix out of core (see external_count.py), None keeps it in memory
+memory_budget_mb = None
+run_dir = '/newdata/co_occ_runs'
 
-'''
-Countvectorizer only creates document-word matricies, so this creates the 20-grams we need from each document in tuples,
-then creates a list of all the 20-grams flattened into strings. Countvectorizer treats each 20-gram as a document so we
-effectively have a word-word matrix 
-'''
-def generate_co_occurrence_matrix(v):
-        co_occ = dok_matrix((v.shape[0],v.shape[0]), dtype=np.int32)
-        count = len(files)
-        word_map = {vocab[i]:i for i in range(vocab.shape[0])}
-        progress = 0
-        vocab_set = set(v)
-        for f in files[:100]:
-                print('Twenty grams for ' + f +' : '+ str(progress) + '/' +str(count))
-                raw_file = open(f,'r')
-                #raw_text = ' '.join(raw_file.read().splitlines()) 
-                raw_text = raw_file.read().split()
-                raw_file.close()
-                twenty_grams = [' '.join(raw_text[i:i+20]).strip() for i in range(len(raw_text)-20)]
-                X = np.zeros((1,v.shape[0]))
-                print('Looping through twenty_grams')
-                for tw in twenty_grams:
-                    X = dok_matrix((1,v.shape[0]))
-                    for w in tw.split():
-                        if w.lower() in vocab_set:
-                            X[0,word_map[w.lower()]] += 1
-                    co_occ += X.transpose() * X
-                    #co_occ[[i[0] for i in nz_combo2],[i[1] for i in nz_combo2]] += 1
-                # co_occ[i, j]
-                # Split file into 20-grams
-                #twenty_grams = [' '.join(w) for w in ngrams(raw_text.split(),20)]
-                #print('Fitting count vectorizer')
-                #vectorizer = CountVectorizer(analyzer='word',vocabulary=vocab)
-                #X = vectorizer.fit_transform(twenty_grams)
-                #co_occ += np.matmul(X.T,X)
-                progress += 1
-                print('done')
-        np.savez_compressed('co_occ_matrix_10KQ_12-1',co_occurrence=co_occ)
-        return co_occ,word_map
-
-def calculate_pmi(com,freqdist,vocabulary,vocab_index):
-        pmi_dict = {'word':[],'pmi':[]}
+def calculate_pmi(seed_counts,freqs,vocabulary,k=1000):
+        #seed_counts holds the co-occurrence rows of the seed words, one row per seed
         print('--Calculating pmi--')
         print('N = ' + str(N) + ', C = ' + str(C))
-        a = len(vocabulary)
-        count = 0
-        for word in vocabulary:
-                if (count % 500 == 0):
-                        print(str(count) + '/' + str(a))
-                n_w = freqdist[word]
-                c_w = sum([com[vocab_index[word], vocab_index[w]] for w in word_list if (w in freqdist and w in vocab_index)])
-                if(c_w != 0):
-                        pmi = math.log10((c_w / C) / (n_w / N)) 
-                        print('word: {} ,pmi: {}'.format(word,pmi))
-                        pmi_dict['word'].append(word)
-                        pmi_dict['pmi'].append(pmi)
-                        count += 1
-        df_out = pd.DataFrame(pmi_dict)
-        return df_out.sort_values('pmi',ascending=False).reset_index(drop=True)
+        return pmi_table(seed_counts, freqs, vocabulary, N, C, k)
 
 #List of words we're starting with
 word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
@@ -84,7 +58,8 @@ word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'p
 print('text loaded, loading freq dist and vocab')
 
 os.chdir(output_dir)
-freq_dist = pickle.load(open('freqdist_10KQ_11-7.pkl','rb'))
+#The array-backed table from vocab_gen.py maps straight in, the pickle is the fallback
+freq_dist = load_freq_dist('freqtable_10KQ_11-7', 'freqdist_10KQ_11-7.pkl')
 print('Frequency distribution loaded, loading vocab')
 
 #Redo calculations
@@ -92,15 +67,61 @@ vocab = np.load('vocab_final_11-8.npz')['vocabulary']
 print('Loading co-occ matrix')
 
 print('Calculating N and C')
-N = sum([freq_dist[t] for t in vocab])
-C = sum([freq_dist[w] for w in word_list if w in freq_dist])
+freqs = freq_array(freq_dist, vocab)
+N = freqs.sum()
+C = freq_dist.total(word_list)
 print(N)
 print(C)
 
-#Generate the co-occurence matrix and the vocab index	
-X, v_index = generate_co_occurrence_matrix(vocab)
+cache = None if cache_dir is None else TokenCache(cache_dir)
+#Seeds that made it into the vocabulary, repeats included like the old per-word sum
+v_index = vocab_index(vocab)
+seed_words = [w for w in word_list if (w in freq_dist and w in v_index)]
+seeds = [v_index[w] for w in seed_words]
+#Stored matrices (see artifacts.py) are reused when they were counted from the same vocab, window and files
+matrix_path = 'co_occ_matrix_' + file_type
+seed_path = 'co_occ_seed_rows_' + file_type
+if windows is not None:
+        #window itself is always one of them so pmi10K_fast.csv still gets written
+        by_window, v_index = generate_multi_window_co_occurrence_matrix(files, vocab, sorted(set(windows) | {window}), seeds,
+                                                                       cache=cache, tokenizer=tokenizer)
+        by_window = {w: m.toarray() for w, m in by_window.items()}
+        df_windows = pmi_by_window(by_window, freqs, vocab, N, C)
+        print(df_windows.head(10))
+        df_windows.to_csv('pmi10K_windows.csv')
+        seed_counts = by_window[window]
+elif matches(matrix_path, vocab, window, files, tokenizer=tokenizer):
+        print('Loading co-occ matrix from ' + matrix_path)
+        X, meta = load_matrix(matrix_path, vocab)
+        seed_counts = seed_rows(X, seeds)
+elif seed_only and matches(seed_path, vocab, window, files, seed_words, tokenizer):
+        print('Loading seed rows from ' + seed_path)
+        X, meta = load_matrix(seed_path, vocab)
+        seed_counts = X.toarray()
+elif seed_only:
+        if processes > 1:
+                X, v_index = parallel_co_occurrence_matrix(files, vocab, checkpoint_dir, window, seeds, processes, cache_dir=cache_dir,
+                                                           tokenizer=tokenizer)
+        else:
+                X, v_index = generate_seed_co_occurrence_matrix(files, vocab, seeds, window, cache=cache, tokenizer=tokenizer)
+        save_matrix(seed_path, X, vocab, window, files, seed_words, tokenizer=tokenizer)
+        seed_counts = X.toarray()
+else:
+        #Generate the co-occurence matrix and the vocab index	
+        if memory_budget_mb is not None:
+                external_co_occurrence_matrix(files, vocab, matrix_path, run_dir, window, memory_budget_mb, cache=cache,
+                                              tokenizer=tokenizer)
+                X, meta = load_matrix(matrix_path, vocab)
+        elif processes > 1:
+                X, v_index = parallel_co_occurrence_matrix(files, vocab, checkpoint_dir, window, processes=processes,
+                                                           cache_dir=cache_dir, tokenizer=tokenizer)
+        else:
+                X, v_index = generate_co_occurrence_matrix(files, vocab, window, cache=cache, tokenizer=tokenizer)
+        if memory_budget_mb is None:
+                save_matrix(matrix_path, X, vocab, window, files, tokenizer=tokenizer)
+        seed_counts = seed_rows(X, seeds)
 #Generate the list of word and their pmi's in sorted order
-df_pmi = calculate_pmi(X, freq_dist, vocab,v_index)
+df_pmi = calculate_pmi(seed_counts, freqs, vocab)
 print('Top 10 PMI values: ')
 print(df_pmi.head(10))
 #Dump to csv - top 1000
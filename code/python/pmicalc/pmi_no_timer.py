@@ -7,6 +7,12 @@ import numpy as np
 import math
 import pickle
 import itertools        
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer
+from pmicalc.cooccurrence import generate_seed_co_occurrence_matrix, vocab_index
+from pmicalc.artifacts import save_matrix
+from pmicalc.pmi import freq_array, pmi_table
 '''
 Generates a co-occurence matrix using the given data, vocabulary and frequency distribution
 '''
@@ -17,67 +23,27 @@ files = ['/newdata/10-19_DATA_CLEAN_2019/10K/' + f for f in os.listdir('/newdata
 output_dir = "/newdata"
 #Named based on what type of files you're looking a, either 10K's, 10Q's or combined (10KQ).
 file_type = '10KQ'
+#How the raw files are split into tokens (see corpus.py), the same as every other stage by
+#default. 'whitespace' opts into the old 20-gram loop's split() and lowercase
+tokenizer = default_tokenizer
 
 '''
-Countvectorizer only creates document-word matricies, so this creates the 20-grams we need from each document in tuples,
-then creates a list of all the 20-grams flattened into strings. Countvectorizer treats each 20-gram as a document so we
-effectively have a word-word matrix 
+Only the rows of the seed words are ever read, so only those are counted: the seed mode of
+cooccurrence.py keeps a |seeds| x V matrix instead of a dense V x V one.
 '''
 def generate_co_occurrence_matrix(v):
-        co_occ = np.zeros((v.shape[0],v.shape[0]),dtype=np.int32)
-        count = len(files)
-        word_map = {vocab[i]:i for i in range(vocab.shape[0])}
-        progress = 0
-        vocab_set = set(v)
-        for f in files:
-                print('Twenty grams for ' + f +' : '+ str(progress) + '/' +str(count))
-                raw_file = open(f,'r')
-                #raw_text = ' '.join(raw_file.read().splitlines()) 
-                raw_text = raw_file.read().split()
-                raw_file.close()
-                twenty_grams = [' '.join(raw_text[i:i+20]).strip() for i in range(len(raw_text)-20)]
-                X = np.zeros((1,v.shape[0]))
-                print('Looping through twenty_grams')
-                for tw in twenty_grams:
-                    X = np.zeros((1,v.shape[0]))
-                    nonz = []
-                    for w in tw.split():
-                        if w.lower() in vocab_set:
-                            #X[0,word_map[w.lower()]] += 1
-                            nonz.append(word_map[w.lower()])
-                    nz_combo2 = list(itertools.product(nonz,repeat=2))
-                    co_occ[[i[0] for i in nz_combo2],[i[1] for i in nz_combo2]] += 1
-                # co_occ[i, j]
-                # Split file into 20-grams
-                #twenty_grams = [' '.join(w) for w in ngrams(raw_text.split(),20)]
-                #print('Fitting count vectorizer')
-                #vectorizer = CountVectorizer(analyzer='word',vocabulary=vocab)
-                #X = vectorizer.fit_transform(twenty_grams)
-                #co_occ += np.matmul(X.T,X)
-                progress += 1
-                print('done')
-        np.savez_compressed('co_occ_matrix_10KQ_11-9',co_occurrence=co_occ)
-        return co_occ,word_map
+        word_map = vocab_index(v)
+        seed_words = [w for w in word_list if (w in freq_dist and w in word_map)]
+        co_occ, word_map = generate_seed_co_occurrence_matrix(files, v, [word_map[w] for w in seed_words], 20,
+                                                              tokenizer=tokenizer)
+        save_matrix('co_occ_seed_rows_10KQ_11-9', co_occ, v, 20, files, seed_words, tokenizer=tokenizer)
+        return co_occ.toarray(),word_map
 
-def calculate_pmi(com,freqdist,vocabulary,vocab_index):
-        pmi_dict = {'word':[],'pmi':[]}
+def calculate_pmi(seed_counts,freqdist,vocabulary,k=1000):
         print('--Calculating pmi--')
         print('N = ' + str(N) + ', C = ' + str(C))
-        a = len(vocabulary)
-        count = 0
-        for word in vocabulary:
-                if (count % 500 == 0):
-                        print(str(count) + '/' + str(a))
-                n_w = freqdist[word]
-                c_w = sum([com[vocab_index[word], vocab_index[w]] for w in word_list if (w in freqdist and w in vocab_index)])
-                if(c_w != 0):
-                        pmi = math.log10((c_w / C) / (n_w / N)) 
-                        print('word: {} ,pmi: {}'.format(word,pmi))
-                        pmi_dict['word'].append(word)
-                        pmi_dict['pmi'].append(pmi)
-                        count += 1
-        df_out = pd.DataFrame(pmi_dict)
-        return df_out.sort_values('pmi',ascending=False).reset_index(drop=True)
+        #seed_counts holds the co-occurrence rows of the seed words, one row per seed
+        return pmi_table(seed_counts, freq_array(freqdist, vocabulary), vocabulary, N, C, k)
 
 #List of words we're starting with
 word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
@@ -93,7 +59,7 @@ vocab = np.load('vocab_final_11-8.npz')['vocabulary']
 print('Loading co-occ matrix')
 
 print('Calculating N and C')
-N = sum([freq_dist[t] for t in vocab])
+N = freq_array(freq_dist, vocab).sum()
 C = sum([freq_dist[w] for w in word_list if w in freq_dist])
 print(N)
 print(C)
@@ -101,7 +67,7 @@ print(C)
 #Generate the co-occurence matrix and the vocab index	
 X, v_index = generate_co_occurrence_matrix(vocab)
 #Generate the list of word and their pmi's in sorted order
-df_pmi = calculate_pmi(X, freq_dist, vocab,v_index)
+df_pmi = calculate_pmi(X, freq_dist, vocab)
 print('Top 10 PMI values: ')
 print(df_pmi.head(10))
 #Dump to csv - top 1000
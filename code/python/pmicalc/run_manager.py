@@ -0,0 +1,143 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+'''
+Resumable runs over a list of files for scripts that write one or more output files per
+input file (lexicon_chunking.py).
+
+The manager keeps manifest.json in run_dir: the settings of the run and, for every input
+that is done, the path, size and hash of each output it wrote. A restart loads it, checks
+that the outputs of every finished input are still there with the same size and hash, and
+only hands the rest to the pool, so a killed run picks up where it stopped without
+editing anything. The manifest is written atomically (temporary file, then rename) every
+save_every seconds and at the end. An input finished after the last save is simply done
+again, which is safe as long as the task writes its outputs atomically too (see
+write_atomic). progress.json, rewritten at the same moments, has the counts, the
+throughput and the ETA of the running job.
+'''
+
+_task = None
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def write_atomic(path, text, encoding=None):
+    #Write under a temporary name and rename so a crash never leaves half a file
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding=encoding) as out:
+        out.write(text)
+    os.replace(tmp, path)
+
+
+def output_entries(paths):
+    return [[p, os.path.getsize(p), file_hash(p)] for p in paths]
+
+
+def _init_worker(task, initializer, initargs):
+    global _task
+    _task = task
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_task(key):
+    #Hashing happens in the worker so the parent only records the result
+    return key, output_entries(_task(key))
+
+
+class RunManager:
+
+    def __init__(self, run_dir, settings, save_every=30, verify=True):
+        '''
+        settings (anything JSON can hold) have to match the ones a run_dir was started
+        with. verify False only checks sizes on restart instead of rehashing every output.
+        '''
+        os.makedirs(run_dir, exist_ok=True)
+        self.manifest_path = os.path.join(run_dir, 'manifest.json')
+        self.progress_path = os.path.join(run_dir, 'progress.json')
+        self.settings = json.loads(json.dumps(settings))
+        self.save_every = save_every
+        self.done = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['settings'] != self.settings:
+                raise ValueError('The run in ' + run_dir + ' was started with different settings: '
+                                 + str(manifest['settings']) + ' vs ' + str(self.settings))
+            self.done = {key: entries for key, entries in manifest['done'].items() if self._intact(entries, verify)}
+            lost = len(manifest['done']) - len(self.done)
+            if lost:
+                print(str(lost) + ' finished inputs have missing or changed outputs and are done again')
+
+    @staticmethod
+    def _intact(entries, verify):
+        for path, size, sha in entries:
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+            if verify and file_hash(path) != sha:
+                return False
+        return True
+
+    def save(self):
+        write_atomic(self.manifest_path, json.dumps({'settings': self.settings, 'done': self.done}))
+
+    def _report(self, total, resumed, finished, start):
+        elapsed = time.time() - start
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        left = total - resumed - finished
+        eta = left / rate if rate > 0 else None
+        progress = {'total': total, 'done': resumed + finished, 'resumed': resumed, 'this_run': finished,
+                    'left': left, 'elapsed_s': round(elapsed, 1), 'files_per_s': round(rate, 3),
+                    'eta_s': None if eta is None else round(eta, 1),
+                    'eta': None if eta is None else time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + eta)),
+                    'updated': time.strftime('%Y-%m-%d %H:%M:%S')}
+        write_atomic(self.progress_path, json.dumps(progress, indent=1))
+        return progress
+
+    def run(self, keys, task, processes=None, initializer=None, initargs=(), chunksize=1):
+        '''
+        Calls task(key) for every key (a file name, say) that is not done yet and records
+        the output paths it returns. task runs in processes forked workers, after
+        initializer(*initargs); processes=1 runs everything in this process.
+        '''
+        keys = list(keys)
+        todo = [k for k in keys if k not in self.done]
+        resumed = len(keys) - len(todo)
+        print(str(resumed) + '/' + str(len(keys)) + ' inputs already done, ' + str(len(todo)) + ' to go')
+        start = last_save = time.time()
+        finished = 0
+        self._report(len(keys), resumed, finished, start)
+        if processes == 1:
+            _init_worker(task, initializer, initargs)
+            results = map(_run_task, todo)
+            pool = None
+        else:
+            ctx = multiprocessing.get_context('fork')
+            pool = ctx.Pool(processes, initializer=_init_worker, initargs=(task, initializer, initargs))
+            results = pool.imap_unordered(_run_task, todo, chunksize)
+        try:
+            for key, entries in results:
+                self.done[key] = entries
+                finished += 1
+                if time.time() - last_save >= self.save_every:
+                    self.save()
+                    progress = self._report(len(keys), resumed, finished, start)
+                    print('Done ' + str(progress['done']) + '/' + str(len(keys)) + ', ' + str(progress['files_per_s'])
+                          + ' files/s, ETA ' + str(progress['eta']))
+                    last_save = time.time()
+        finally:
+            #Also on a crash or Ctrl-C, so the next run skips everything finished so far
+            if pool is not None:
+                pool.terminate()
+            self.save()
+            self._report(len(keys), resumed, finished, start)
+        return self.done
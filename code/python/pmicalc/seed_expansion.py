@@ -0,0 +1,139 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import default_tokenizer, list_files
+from pmicalc.cooccurrence import generate_seed_co_occurrence_matrix, seed_rows, vocab_index
+from pmicalc.artifacts import load_matrix, matches, read_meta, save_matrix
+from pmicalc.pmi import freq_array, pmi_scores, top_k
+from pmicalc.token_cache import TokenCache
+from pmicalc.freq_table import load_freq_dist
+
+'''
+Grows a lexicon from a few seed words. Every round scores the vocabulary by PMI against
+the current lexicon, adds the best new words to it, and goes again until nothing new
+makes the cut or the top of the ranking stops moving.
+
+Only the co-occurrence rows of the lexicon words are needed. They come either from a stored
+full matrix or from a seed-mode pass over the corpus, and every row is kept in a SeedRowCache
+so a round only computes rows for the words added in the round before.
+'''
+
+
+class SeedRowCache:
+    '''
+    Co-occurrence rows by word id, saved to path (an artifacts.py seed-row matrix) so
+    other runs with the same vocabulary, window and files can reuse them
+    '''
+
+    def __init__(self, path, vocab, window, files, compute):
+        #compute(ids) returns the rows for a list of word ids as a len(ids) x V array
+        self.path, self.vocab, self.window, self.files = path, vocab, window, files
+        self.compute = compute
+        self.rows = {}
+        if path is not None and os.path.exists(os.path.join(path, 'meta.json')):
+            #Check before loading: a cache from another vocabulary or corpus is started over
+            if matches(path, vocab, window, files, read_meta(path)['seeds']):
+                X, meta = load_matrix(path, vocab)
+                word_map = vocab_index(vocab)
+                self.rows = {word_map[w]: X[i].toarray().ravel() for i, w in enumerate(meta['seeds'])}
+                print('Loaded ' + str(len(self.rows)) + ' cached rows from ' + path)
+            else:
+                print('Cached rows in ' + path + ' are from other settings and are computed again')
+
+    def get(self, ids):
+        missing = [i for i in dict.fromkeys(ids) if i not in self.rows]
+        if missing:
+            print('Computing rows for ' + str(len(missing)) + ' new seeds')
+            for i, row in zip(missing, np.asarray(self.compute(missing))):
+                self.rows[i] = np.asarray(row, dtype=np.int64).ravel()
+            self.save()
+        return np.vstack([self.rows[i] for i in ids])
+
+    def save(self):
+        if self.path is None or not self.rows:
+            return
+        ids = list(self.rows)
+        save_matrix(self.path, scipy.sparse.csr_matrix(np.vstack([self.rows[i] for i in ids])),
+                    self.vocab, self.window, self.files, [self.vocab[i] for i in ids])
+
+
+def expand_lexicon(seed_ids, freqs, N, row_cache, promote=10, k=1000, min_pmi=None,
+                   min_count=1, max_rounds=20, overlap_tol=0.0):
+    '''
+    Takes the starting seed ids, the frequency array, N and a SeedRowCache. Each round the
+    promote best words that are not in the lexicon yet (and score at least min_pmi) join
+    it. Stops when none qualify, when at least 1 - overlap_tol of the top k is the same
+    as in the round before, or after max_rounds. Returns the lexicon ids, the round each
+    one joined (0 for seeds) and the scores of the last round.
+    '''
+    lexicon = list(dict.fromkeys(seed_ids))
+    joined = {i: 0 for i in lexicon}
+    previous = None
+    scores = None
+    for r in range(1, max_rounds + 1):
+        rows = row_cache.get(lexicon)
+        C = freqs[lexicon].sum()
+        scores = pmi_scores(rows, freqs, N, C, min_count)
+        ranked = top_k(scores, k)
+        new = [i for i in ranked if i not in joined and (min_pmi is None or scores[i] >= min_pmi)][:promote]
+        overlap = None if previous is None else len(set(ranked) & previous) / max(len(ranked), 1)
+        print('Round ' + str(r) + ': ' + str(len(lexicon)) + ' words, ' + str(len(new)) + ' new'
+              + ('' if overlap is None else ', top ' + str(k) + ' overlap ' + str(round(overlap, 3))))
+        if not new or (overlap is not None and overlap >= 1 - overlap_tol):
+            break
+        for i in new:
+            joined[i] = r
+        lexicon += new
+        previous = set(ranked)
+    return lexicon, joined, scores
+
+
+def lexicon_table(lexicon, joined, scores, vocab):
+    return pd.DataFrame({'word': [vocab[i] for i in lexicon], 'round': [joined[i] for i in lexicon],
+                         'pmi': [scores[i] for i in lexicon]})
+
+
+if __name__ == '__main__':
+    #Directory with the vocab and freq dist from vocab_gen.py, output goes here too
+    output_dir = '/newdata'
+    file_type = '10KQ'
+    window = 20
+    word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
+    #How many words join per round, and how far down the ranking to look
+    promote = 10
+    k = 1000
+    #Token cache made by token_cache.py, None reads and tokenizes the raw files
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    freq_dist = load_freq_dist('freqtable_10KQ_11-7', 'freqdist_10KQ_11-7.pkl')
+    vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    freqs = freq_array(freq_dist, vocab)
+    v_index = vocab_index(vocab)
+    seeds = [v_index[w] for w in word_list if (w in freq_dist and w in v_index)]
+
+    matrix_path = 'co_occ_matrix_' + file_type
+    #The package tokenizer, which pmi_fast.py stamps its matrices with unless told otherwise
+    if matches(matrix_path, vocab, window, files, tokenizer=default_tokenizer):
+        #Rows come straight out of the stored full matrix
+        X, meta = load_matrix(matrix_path, vocab)
+        compute = lambda ids: seed_rows(X, ids)
+    else:
+        if os.path.exists(os.path.join(matrix_path, 'meta.json')):
+            stored = read_meta(matrix_path)
+            print(matrix_path + ' was counted with other settings (' + str(stored['tokenizer']) + ', window '
+                  + str(stored['window']) + '), counting seed rows from the files')
+        cache = None if cache_dir is None else TokenCache(cache_dir)
+        compute = lambda ids: generate_seed_co_occurrence_matrix(files, vocab, ids, window, cache=cache,
+                                                                 tokenizer=default_tokenizer)[0].toarray()
+    row_cache = SeedRowCache('seed_row_cache_' + file_type, vocab, window, files, compute)
+
+    lexicon, joined, scores = expand_lexicon(seeds, freqs, freqs.sum(), row_cache, promote, k)
+    df_lex = lexicon_table(lexicon, joined, scores, vocab)
+    print(df_lex)
+    df_lex.to_csv('lexicon_expanded_' + file_type + '.csv')
@@ -0,0 +1,99 @@
+import numpy as np
+import regex as re
+
+'''
+Rule-based sentence boundaries for the cleaned filings, as character offsets into the
+text instead of token lists, so chunks can be cut out of the original text with their
+punctuation.
+
+A sentence ends at . ! or ? (with any closing quotes or brackets) followed by whitespace,
+and at a blank line. A period does not end one when the next word starts with a lowercase
+letter, or when it closes
+    an abbreviation           Inc. Corp. approx. Jan. e.g. (see abbreviations)
+    No. or Nos. before a number    No. 3, Nos. 4 and 5
+    a single letter or a dotted acronym    J. Smith, U.S. Government, N.A.
+    an item number            Item 1A. Risk Factors, Note 3. Debt
+    a list marker             1. / (a). / iv. at the start of a sentence
+'''
+
+#Words (lowercase, without their last period) that a period follows without ending the sentence
+abbreviations = frozenset([
+    'inc', 'corp', 'co', 'cos', 'ltd', 'llc', 'llp', 'plc', 'bros', 'assn', 'dept', 'div', 'intl', 'natl',
+    'mr', 'mrs', 'ms', 'dr', 'jr', 'sr', 'st', 'messrs', 'hon', 'prof', 'gov', 'sen', 'rep',
+    'vs', 'approx', 'est', 'avg', 'max', 'min', 'sec', 'secs', 'art', 'reg', 'regs', 'fig', 'vol',
+    'pp', 'para', 'cf', 'ca', 'viz', 'al',
+    'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+    'e.g', 'i.e', 'u.s', 'u.k', 'u.s.a', 'n.a', 'l.p', 'p.c', 's.a', 'n.v', 'a.m', 'p.m'])
+
+#Words a period follows without ending the sentence only when a number comes next
+number_words = frozenset(['no', 'nos'])
+
+#Words an item number follows (Item 7. Management's Discussion ...)
+item_words = frozenset(['item', 'items', 'note', 'notes', 'part', 'section', 'article', 'schedule', 'exhibit', 'rule', 'form'])
+
+_candidate = re.compile(r'[.!?]+["\'’”)\]]*(\s+)|\n[^\S\n]*\n\s*')
+_acronym = re.compile(r'(?:[A-Za-z]\.)+[A-Za-z]')
+_item_number = re.compile(r'\d{1,3}[A-Za-z]?|[IVXivx]{1,5}')
+_list_marker = re.compile(r'\(?(?:\d{1,2}|[A-Za-z]|[ivxIVX]{1,5})\)?')
+
+
+def _last_words(text, start, end):
+    #The word that ends at end and the one before it ('' if none), not looking back past start
+    i = end
+    while i > start and not text[i - 1].isspace():
+        i -= 1
+    j = i
+    while j > start and text[j - 1].isspace():
+        j -= 1
+    k = j
+    while k > start and not text[k - 1].isspace():
+        k -= 1
+    return text[k:j], text[i:end]
+
+
+def _ends_sentence(text, start, match):
+    if match.group(1) is None:
+        #A blank line
+        return True
+    after = match.end()
+    if after < len(text) and text[after].islower():
+        return False
+    punctuation = match.group(0)
+    if '?' in punctuation or '!' in punctuation:
+        return True
+    previous, last = _last_words(text, start, match.start())
+    word = last.lstrip('("\'‘“[')
+    if not word:
+        return True
+    if word.lower() in number_words and after < len(text) and text[after].isdigit():
+        return False
+    if word.lower() in abbreviations or (len(word) == 1 and word.isalpha()) or _acronym.fullmatch(word):
+        return False
+    if previous.lower() in item_words and _item_number.fullmatch(word):
+        return False
+    if not previous and _list_marker.fullmatch(last):
+        return False
+    return True
+
+
+def sentence_spans(text):
+    '''
+    (starts, ends) of the sentences in text as int64 character offsets, ends exclusive and
+    right after the closing punctuation, leading and trailing whitespace left out
+    '''
+    starts, ends = [], []
+    start = len(text) - len(text.lstrip())
+    for match in _candidate.finditer(text):
+        if match.start() < start or not _ends_sentence(text, start, match):
+            continue
+        end = match.start(1) if match.group(1) is not None else match.start()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            starts.append(start)
+            ends.append(end)
+        start = match.end()
+    if text[start:].strip():
+        starts.append(start)
+        ends.append(len(text.rstrip()))
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
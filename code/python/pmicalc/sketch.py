@@ -0,0 +1,223 @@
+import math
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import list_files
+from pmicalc.cooccurrence import file_ids, vocab_index, window_pairs
+from pmicalc.artifacts import file_manifest, read_meta, tokenizer_settings, vocab_hash, write_streamed
+from pmicalc.freq_table import load_freq_dist
+from pmicalc.pmi import freq_array, pmi_table
+from pmicalc.token_cache import TokenCache
+
+'''
+Approximate co-occurrence counts from a count-min sketch, for exploratory PMI against any
+seed words without building a matrix.
+
+Every word pair (row <= col, as in cooccurrence.py) is hashed into one cell of each of
+depth rows of width counters. A pair's estimate is the smallest of its depth cells, which
+is never below the true count and, with width = e / epsilon and depth = ln(1 / delta),
+is above it by at most epsilon * total with probability 1 - delta (total being the sum
+of all counts added). Conservative update only raises a cell as far as the pair's new
+estimate needs, which keeps the overestimates well under that bound in practice.
+
+Memory is fixed at depth * width counters plus the heavy_hitters best pairs, which are
+kept alongside so the strongest pairs of the whole corpus can be listed too. sketch_files
+sizes the table from a memory budget (memory_mb, 64 MB by default) and reports the epsilon
+that comes out of it; from_error goes the other way, from epsilon to the table.
+'''
+
+
+class CoOccurrenceSketch:
+
+    def __init__(self, v_size, width=2 ** 20, depth=4, heavy_hitters=1000, seed=0):
+        #Width is rounded up to a power of two so a multiply-shift hash can pick the cell
+        self.bits = max(int(math.ceil(math.log2(max(width, 2)))), 1)
+        self.width, self.depth = 2 ** self.bits, depth
+        self.v_size = v_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+        self.table = np.zeros((depth, self.width), dtype=np.int64)
+        self.total = 0
+        self.n_heavy = heavy_hitters
+        self.heavy_keys = np.zeros(0, dtype=np.int64)
+        self.heavy_counts = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_error(cls, v_size, epsilon=1e-5, delta=1e-3, heavy_hitters=1000, seed=0):
+        '''Sketch sized for estimates within epsilon * total of the truth with probability 1 - delta'''
+        return cls(v_size, int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1 / delta))), heavy_hitters, seed)
+
+    @classmethod
+    def from_memory(cls, v_size, memory_mb=64, delta=1e-3, heavy_hitters=1000, seed=0):
+        '''
+        The widest sketch whose table fits in memory_mb, with depth for probability
+        1 - delta. Its epsilon() is the error that buys.
+        '''
+        depth = int(math.ceil(math.log(1 / delta)))
+        counters = int(memory_mb * 2 ** 20) // (np.dtype(np.int64).itemsize * depth)
+        #Rounded down to a power of two, the constructor would round up past the budget
+        return cls(v_size, 2 ** max(int(math.floor(math.log2(max(counters, 2)))), 1), depth, heavy_hitters, seed)
+
+    def epsilon(self):
+        return math.e / self.width
+
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def error_bound(self):
+        '''How far above the true count an estimate can be, with probability 1 - delta'''
+        return self.epsilon() * self.total
+
+    def _cells(self, keys):
+        keys = keys.astype(np.uint64)
+        return ((self.a[:, None] * keys[None, :] + self.b[:, None]) >> np.uint64(64 - self.bits)).astype(np.intp)
+
+    def _estimate_cells(self, cells):
+        return self.table[np.arange(self.depth)[:, None], cells].min(axis=0)
+
+    def keys(self, rows, cols):
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        return np.minimum(rows, cols) * self.v_size + np.maximum(rows, cols)
+
+    def add(self, rows, cols, weights):
+        '''Adds weighted pairs, e.g. the output of window_pairs'''
+        keys, inverse = np.unique(self.keys(rows, cols), return_inverse=True)
+        if len(keys) == 0:
+            return
+        weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys)).astype(np.int64)
+        cells = self._cells(keys)
+        #Conservative update: no cell goes above the pair's old estimate plus its weight.
+        #Pairs sharing a cell in one batch get the largest of their targets, so no estimate drops below its count
+        target = self._estimate_cells(cells) + weights
+        for r in range(self.depth):
+            np.maximum.at(self.table[r], cells[r], target)
+        self.total += int(weights.sum())
+        self._update_heavy(keys)
+
+    def _update_heavy(self, keys):
+        if self.n_heavy == 0:
+            return
+        new = np.setdiff1d(keys, self.heavy_keys, assume_unique=True)
+        if len(self.heavy_keys) >= self.n_heavy:
+            #Only pairs that now beat the weakest kept pair can get in
+            new_counts = self._estimate_cells(self._cells(new))
+            new = new[new_counts > self.heavy_counts.min()]
+        candidates = np.concatenate([self.heavy_keys, new])
+        counts = self.estimate_keys(candidates)
+        if len(candidates) > self.n_heavy:
+            best = np.argpartition(-counts, self.n_heavy - 1)[:self.n_heavy]
+            candidates, counts = candidates[best], counts[best]
+        self.heavy_keys, self.heavy_counts = candidates, counts
+
+    def estimate_keys(self, keys):
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self._estimate_cells(self._cells(np.asarray(keys, dtype=np.int64)))
+
+    def estimate(self, rows, cols):
+        return self.estimate_keys(self.keys(rows, cols))
+
+    def seed_rows(self, seed_ids, noise_floor=False):
+        '''
+        Estimated co-occurrence rows of the seeds as a dense len(seed_ids) x V array, the
+        same shape cooccurrence.seed_rows gives. With noise_floor, estimates within the
+        error bound are set to 0 since they could be all collisions.
+        '''
+        cols = np.arange(self.v_size, dtype=np.int64)
+        rows = np.vstack([self.estimate(np.full(self.v_size, s, dtype=np.int64), cols) for s in seed_ids]) \
+            if len(seed_ids) else np.zeros((0, self.v_size), dtype=np.int64)
+        if noise_floor:
+            rows[rows <= self.error_bound()] = 0
+        return rows
+
+    def heavy_pairs(self):
+        '''The tracked heavy hitters as (rows, cols, estimates), largest first'''
+        order = np.argsort(-self.heavy_counts, kind='stable')
+        keys = self.heavy_keys[order]
+        return keys // self.v_size, keys % self.v_size, self.heavy_counts[order]
+
+    def save(self, path, vocab, window, files):
+        meta = {'kind': 'sketch', 'vocab_hash': vocab_hash(vocab), 'vocab_size': len(vocab), 'window': window,
+                'width': self.width, 'depth': self.depth, 'total': self.total, 'heavy_hitters': self.n_heavy,
+                'files': file_manifest(files), 'tokenizer': tokenizer_settings()}
+
+        def write(tmp):
+            for name in ('table', 'a', 'b', 'heavy_keys', 'heavy_counts'):
+                np.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+
+        write_streamed(path, meta, write)
+
+    @classmethod
+    def load(cls, path, vocab=None, mmap=True):
+        meta = read_meta(path)
+        if vocab is not None and meta['vocab_hash'] != vocab_hash(vocab):
+            raise ValueError(path + ' was sketched with a different vocabulary than the one given')
+        #Made with the smallest table, the saved arrays replace it
+        sketch = cls(meta['vocab_size'], 2, meta['depth'], meta['heavy_hitters'])
+        sketch.bits, sketch.width, sketch.total = int(math.log2(meta['width'])), meta['width'], meta['total']
+        for name in ('table', 'a', 'b', 'heavy_keys', 'heavy_counts'):
+            setattr(sketch, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap and name == 'table' else None))
+        return sketch, meta
+
+
+def sketch_files(files, vocab, window=20, memory_mb=64, delta=1e-3, heavy_hitters=1000, cache=None, progress=True,
+                 epsilon=None):
+    '''
+    One pass over the files into a CoOccurrenceSketch whose table fits in memory_mb, or,
+    with epsilon, one sized for that error instead
+    '''
+    word_map = vocab_index(vocab)
+    if epsilon is None:
+        sketch = CoOccurrenceSketch.from_memory(len(vocab), memory_mb, delta, heavy_hitters)
+    else:
+        sketch = CoOccurrenceSketch.from_error(len(vocab), epsilon, delta, heavy_hitters)
+    print('Sketch of ' + str(sketch.depth) + ' x ' + str(sketch.width) + ' counters ('
+          + str(sketch.table.nbytes // 2 ** 20) + ' MB), epsilon ' + '{:.2g}'.format(sketch.epsilon()))
+    for i, f in enumerate(files):
+        if progress and i % 500 == 0:
+            print('Sketching ' + f + ' : ' + str(i) + '/' + str(len(files)) + ', error bound ' + str(round(sketch.error_bound())))
+        sketch.add(*window_pairs(file_ids(f, word_map, cache), window))
+    return sketch
+
+
+if __name__ == '__main__':
+    #Directory with the vocab and freq dist from vocab_gen.py, output goes here too
+    output_dir = '/newdata'
+    file_type = '10KQ'
+    window = 20
+    #Size of the counter table; estimates are within epsilon * (total count) of the truth with
+    #probability 1 - delta, epsilon being what fits in memory_mb (printed when sketching)
+    memory_mb = 64
+    delta = 1e-3
+    #Seed sets to score, any words in the vocabulary
+    queries = {'supply_chain': ['supply', 'chain', 'shortage', 'logistics'],
+               'remote_work': ['remote', 'telework', 'home', 'wfh']}
+    #Token cache made by token_cache.py, None reads and tokenizes the raw files
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    freq_dist = load_freq_dist('freqtable_10KQ_11-7', 'freqdist_10KQ_11-7.pkl')
+    freqs = freq_array(freq_dist, vocab)
+    N = freqs.sum()
+
+    sketch_path = 'co_occ_sketch_' + file_type
+    if os.path.exists(os.path.join(sketch_path, 'meta.json')):
+        sketch, meta = CoOccurrenceSketch.load(sketch_path, vocab)
+    else:
+        cache = None if cache_dir is None else TokenCache(cache_dir)
+        sketch = sketch_files(files, vocab, window, memory_mb, delta, cache=cache)
+        sketch.save(sketch_path, vocab, window, files)
+    print('Error bound ' + str(sketch.error_bound()) + ' with probability ' + str(1 - sketch.delta()))
+
+    v_index = vocab_index(vocab)
+    for name, words in queries.items():
+        seeds = [v_index[w] for w in words if w in v_index]
+        df_pmi = pmi_table(sketch.seed_rows(seeds, noise_floor=True), freqs, vocab, N, freq_dist.total(words), k=1000)
+        print(name)
+        print(df_pmi.head(10))
+        df_pmi.to_csv('pmi_sketch_' + name + '.csv')
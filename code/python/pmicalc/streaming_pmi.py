@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import list_files
+from pmicalc.cooccurrence import count_seed_ids, expand_seed_rows, file_ids, seed_row_map, sum_parts, vocab_index
+from pmicalc.pmi import pmi_scores, top_k
+from pmicalc.token_cache import TokenCache
+
+'''
+Anytime PMI: seed-mode counting that publishes the current top k every snapshot_every
+files instead of only at the end.
+
+Co-occurrences and word counts are both kept for the files read so far, so every snapshot
+is the exact PMI of that part of the corpus, and the last one is the PMI of all of it.
+Files are read in a shuffled order (fixed by seed) so every prefix is a fair sample of the
+corpus rather than the first year and form. Between snapshots the overlap of the top
+overlap_k is tracked, and with tol set the run stops once it has stayed at or above
+1 - tol for patience snapshots in a row.
+'''
+
+
+def _write_csv_atomic(df, path):
+    tmp = path + '.tmp'
+    df.to_csv(tmp)
+    os.replace(tmp, path)
+
+
+def streaming_pmi(files, vocab, seeds, window=20, k=1000, snapshot_every=500, overlap_k=100,
+                  tol=None, patience=3, shuffle=True, seed=0, min_count=1, snapshot_path=None,
+                  history_path=None, cache=None):
+    '''
+    Takes the filings, the vocabulary and the seed ids (repeats allowed) and returns
+    (final top k table, history of the snapshots). snapshot_path gets the latest top k
+    table and history_path the history, both rewritten at every snapshot.
+    '''
+    files = list(files)
+    if shuffle:
+        random.Random(seed).shuffle(files)
+    word_map = vocab_index(vocab)
+    v_size = len(vocab)
+    seed_row = seed_row_map(seeds, v_size)
+    vocab = np.asarray(vocab)
+    co_occ = scipy.sparse.csr_matrix((int(seed_row.max()) + 1, v_size), dtype=np.int64)
+    n_w = np.zeros(v_size, dtype=np.int64)
+    parts = []
+    history = []
+    previous, stable = None, 0
+    table = pd.DataFrame({'word': [], 'pmi': []})
+    for i, f in enumerate(files):
+        ids = file_ids(f, word_map, cache)
+        n_w += np.bincount(ids[ids >= 0], minlength=v_size)
+        parts.append(count_seed_ids(ids, seed_row, v_size, window))
+        done = i + 1
+        if done % snapshot_every and done != len(files):
+            continue
+        co_occ = co_occ + sum_parts(parts, co_occ.shape[0], v_size)
+        parts = []
+        scores = pmi_scores(expand_seed_rows(co_occ, seeds, seed_row), n_w, n_w.sum(), n_w[list(seeds)].sum(), min_count)
+        best = top_k(scores, k)
+        table = pd.DataFrame({'word': vocab[best], 'pmi': scores[best]})
+        head = set(best[:overlap_k])
+        overlap = None if previous is None else len(head & previous) / max(len(head), 1)
+        previous = head
+        stable = stable + 1 if tol is not None and overlap is not None and overlap >= 1 - tol else 0
+        history.append({'files': done, 'overlap': overlap})
+        print('Snapshot after ' + str(done) + '/' + str(len(files)) + ' files'
+              + ('' if overlap is None else ', overlap@' + str(overlap_k) + ' ' + str(round(overlap, 3))))
+        if snapshot_path is not None:
+            _write_csv_atomic(table, snapshot_path)
+        if history_path is not None:
+            _write_csv_atomic(pd.DataFrame(history), history_path)
+        if tol is not None and stable >= patience:
+            print('Top ' + str(overlap_k) + ' stable for ' + str(patience) + ' snapshots, stopping after '
+                  + str(done) + ' of ' + str(len(files)) + ' files')
+            break
+    return table, pd.DataFrame(history)
+
+
+if __name__ == '__main__':
+    #Output goes here, the vocab from vocab_gen.py is read from here too
+    output_dir = '/newdata'
+    file_type = '10KQ'
+    window = 20
+    word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
+    snapshot_every = 1000
+    #Stop once the top 100 overlaps by at least 1 - tol for patience snapshots in a row, None reads everything
+    tol = 0.02
+    patience = 3
+    #Token cache made by token_cache.py, None reads and tokenizes the raw files
+    cache_dir = None
+
+    files = list_files()
+    os.chdir(output_dir)
+    vocab = list(np.load('vocab_final_11-8.npz')['vocabulary'])
+    v_index = vocab_index(vocab)
+    seeds = [v_index[w] for w in word_list if w in v_index]
+    cache = None if cache_dir is None else TokenCache(cache_dir)
+    df_pmi, history = streaming_pmi(files, vocab, seeds, window, snapshot_every=snapshot_every, tol=tol, patience=patience,
+                                    snapshot_path='pmi10K_snapshot.csv', history_path='pmi10K_snapshot_history.csv', cache=cache)
+    print(df_pmi.head(10))
+    df_pmi.to_csv('pmi10K_stream.csv')
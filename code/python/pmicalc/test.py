@@ -11,6 +11,9 @@ from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 import math
 import pickle
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.pmi import freq_array, pmi_table
 
 word_list = ['corona','virus', 'coronavirus','ncov', 'sarscov', 'SARS-CoV-2', 'pandemic' ,'epidemic', 'outbreak','lockdown','sarscov','2019-nCoV']
 word_set = set(word_list)
@@ -83,25 +86,12 @@ def generate_co_occurrence_matrix2(corpus_list,context_set, v):
 	co_occ = (X.T * X)
 	return co_occ,vocab_index
 
-def calculate_pmi(com,freqdist,vocabulary,vocab_index):
-	pmi_dict = {'word':[],'pmi':[]}
+def calculate_pmi(com,freqdist,vocabulary,vocab_index,k=1000):
 	print('--Calculating pmi--')
 	print('N = ' + str(N) + ', C = ' + str(C))
-	a = len(vocabulary)
-	count = 0
-	for word in vocabulary:
-		if (count % 500 == 0): 
-			print(str(count) + '/' + str(a))
-		n_w = freqdist[word]
-		c_w = sum([com[vocab_index[word], vocab_index[w]] for w in word_list if (w in freqdist and w in vocab_index)])
-		if(c_w != 0):
-			pmi = math.log10(c_w) + math.log10(N) - math.log10(C) - math.log10(n_w)
-			print('word: {} ,pmi: {}'.format(word,pmi))
-			pmi_dict['word'].append(word)
-			pmi_dict['pmi'].append(pmi)
-			count += 1
-	df_out = pd.DataFrame(pmi_dict)
-	return df_out.sort_values('pmi',ascending=False).reset_index(drop=True)	
+	#Only the seed rows are read, one row per seed
+	seeds = [vocab_index[w] for w in word_list if (w in freqdist and w in vocab_index)]
+	return pmi_table(com[seeds], freq_array(freqdist, vocabulary), vocabulary, N, C, k)
 
 print('Generating co-occ matrix')
 X,word2index = generate_co_occurrence_matrix(vocab)
@@ -0,0 +1,109 @@
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import list_files, read_tokens, token_reg
+
+'''
+Tokenizes the corpus once and keeps it on disk as token ids, so the later stages stop
+running the regex over the raw text and all of them see exactly the same tokens.
+
+A cache directory holds
+    tokens.u32     every file's token ids back to back (uint32, memory-mapped when read)
+    offsets.npy    file i is tokens[offsets[i]:offsets[i + 1]]
+    files.txt      the file paths, one per line
+    vocab.txt      the token of every id, one per line
+    meta.json      tokenizer settings and sizes
+Tokens are lowercased but nothing else is dropped (stop words included), so token
+positions are the same as in the text.
+'''
+
+
+def _tokenize_file(path):
+    #Ids local to this file, the parent maps them onto the shared vocabulary
+    local = {}
+    ids = np.fromiter((local.setdefault(t, len(local)) for t in read_tokens(path)), dtype=np.uint32)
+    return list(local), ids
+
+
+def build_cache(files, cache_dir, processes=None):
+    '''Tokenizes files in a pool of workers and writes the cache to cache_dir'''
+    os.makedirs(cache_dir, exist_ok=True)
+    word_map = {}
+    offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    ctx = multiprocessing.get_context('fork')
+    token_path = os.path.join(cache_dir, 'tokens.u32')
+    with open(token_path + '.tmp', 'wb') as token_file, ctx.Pool(processes) as pool:
+        #imap keeps file order, which is the order the ids are written in
+        for i, (local_vocab, ids) in enumerate(pool.imap(_tokenize_file, files, chunksize=16)):
+            lookup = np.fromiter((word_map.setdefault(t, len(word_map)) for t in local_vocab),
+                                 dtype=np.uint32, count=len(local_vocab))
+            token_file.write(lookup[ids].tobytes())
+            offsets[i + 1] = offsets[i] + len(ids)
+            if i % 1000 == 0:
+                print('Tokenized ' + str(i) + '/' + str(len(files)) + ' files, ' + str(len(word_map)) + ' token types')
+    np.save(os.path.join(cache_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(cache_dir, 'files.txt'), 'w') as file_list:
+        file_list.write('\n'.join(files))
+    with open(os.path.join(cache_dir, 'vocab.txt'), 'w', encoding='utf-8') as vocab_file:
+        vocab_file.write('\n'.join(word_map))
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as meta_file:
+        json.dump({'token_reg': token_reg, 'lowercase': True, 'n_files': len(files),
+                   'n_tokens': int(offsets[-1]), 'n_types': len(word_map)}, meta_file)
+    #Renamed last, so a cache with tokens.u32 in it is complete
+    os.replace(token_path + '.tmp', token_path)
+
+
+class TokenCache:
+    '''Read side of a cache directory made by build_cache'''
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta['token_reg'] != token_reg:
+            raise ValueError('Token cache ' + cache_dir + ' was built with a different token pattern')
+        with open(os.path.join(cache_dir, 'files.txt')) as file_list:
+            self.files = file_list.read().split('\n') if self.meta['n_files'] else []
+        with open(os.path.join(cache_dir, 'vocab.txt'), encoding='utf-8') as vocab_file:
+            self.vocab = vocab_file.read().split('\n') if self.meta['n_types'] else []
+        self.offsets = np.load(os.path.join(cache_dir, 'offsets.npy'))
+        if self.meta['n_tokens']:
+            self.tokens = np.memmap(os.path.join(cache_dir, 'tokens.u32'), dtype=np.uint32, mode='r')
+        else:
+            self.tokens = np.zeros(0, dtype=np.uint32)
+        self.file_index = {f: i for i, f in enumerate(self.files)}
+        self._lookups = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def ids(self, f):
+        '''Cache token ids of a file (by path or position), a view into the memory map'''
+        i = self.file_index[f] if isinstance(f, str) else f
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def words(self, f):
+        return [self.vocab[i] for i in self.ids(f)]
+
+    def lookup(self, word_map):
+        '''
+        Array taking cache ids to the ids of another vocabulary (a word -> index dict),
+        -1 for tokens it does not have. Built once per word_map.
+        '''
+        key = id(word_map)
+        if key not in self._lookups:
+            self._lookups[key] = (word_map, np.fromiter((word_map.get(t, -1) for t in self.vocab),
+                                                        dtype=np.int64, count=len(self.vocab)))
+        return self._lookups[key][1]
+
+    def vocab_ids(self, f, word_map):
+        '''Token ids of a file in the word_map vocabulary, -1 for words outside it'''
+        return self.lookup(word_map)[self.ids(f)]
+
+
+if __name__ == '__main__':
+    cache_dir = '/newdata/token_cache'
+    build_cache(list_files(), cache_dir, os.cpu_count())
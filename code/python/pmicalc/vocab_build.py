@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import sys
+from collections import Counter
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import read_tokens
+from pmicalc.token_cache import TokenCache
+
+'''
+Parallel replacement for CountVectorizer(token_pattern=reg, stop_words=stop, min_df=min_df)
+over the filings.
+
+Pass 1 has the workers count document frequencies for batches of files and the parent adds
+them up, so min_df is applied over the whole corpus. Pass 2 has the workers turn their
+batches into sparse document-term rows over the final vocabulary, which are stacked in file
+order. Batches are cut by file size so the text and token lists held by all workers at once
+stay within memory_budget_mb. With a token cache the workers read ids instead of text and
+document frequencies are counted per cache id.
+'''
+
+#Rough size of the tokens, dicts and id arrays made from one byte of text
+bytes_per_text_byte = 10
+
+_stop = None
+_word_map = None
+_cache = None
+
+
+def _init_worker(stop, vocab, cache_dir):
+    global _stop, _word_map, _cache
+    _stop = frozenset(stop)
+    _word_map = None if vocab is None else {w: i for i, w in enumerate(vocab)}
+    _cache = None if cache_dir is None else TokenCache(cache_dir)
+
+
+def file_terms(path, stop):
+    return [t for t in read_tokens(path) if t not in stop]
+
+
+def _doc_freqs(batch):
+    if _cache is not None:
+        df = np.zeros(len(_cache.vocab), dtype=np.int64)
+        for f in batch:
+            df[np.unique(_cache.ids(f))] += 1
+        return df
+    df = Counter()
+    for f in batch:
+        df.update(set(file_terms(f, _stop)))
+    return df
+
+
+def count_rows(files, word_map, stop, cache=None):
+    '''Sparse document-term rows (int32) for files over a fixed vocabulary'''
+    indptr = [0]
+    indices, data = [], []
+    for f in files:
+        if cache is None:
+            ids = np.fromiter((word_map[t] for t in file_terms(f, stop) if t in word_map), dtype=np.int64)
+        else:
+            #Stop words are not in the vocabulary, so they drop out with the other -1s
+            ids = cache.vocab_ids(f, word_map)
+            ids = ids[ids >= 0]
+        cols, counts = np.unique(ids, return_counts=True)
+        indices.append(cols)
+        data.append(counts)
+        indptr.append(indptr[-1] + len(cols))
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    data = np.concatenate(data) if data else np.zeros(0, dtype=np.int64)
+    return scipy.sparse.csr_matrix((data.astype(np.int32), indices, indptr), shape=(len(files), len(word_map)))
+
+
+def _term_rows(task):
+    i, batch = task
+    return i, count_rows(batch, _word_map, _stop, _cache)
+
+
+def batch_files(files, budget_bytes):
+    '''Consecutive batches of files whose text adds up to at most budget_bytes (at least one file each)'''
+    batches, batch, size = [], [], 0
+    for f in files:
+        f_size = os.path.getsize(f)
+        if batch and size + f_size > budget_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(f)
+        size += f_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_vocabulary(files, stop, min_df=15, processes=None, memory_budget_mb=4096, cache_dir=None):
+    '''
+    Returns (X, vocab): the files x vocab document-term csr_matrix (int32) and the sorted
+    list of terms that show up in at least min_df files, the same as CountVectorizer gives.
+    cache_dir is an optional token cache to read the files from.
+    '''
+    processes = processes or os.cpu_count()
+    budget_bytes = memory_budget_mb * 2 ** 20 // (processes * bytes_per_text_byte)
+    batches = batch_files(files, budget_bytes)
+    print(str(len(files)) + ' files in ' + str(len(batches)) + ' batches')
+    ctx = multiprocessing.get_context('fork')
+
+    cache = None if cache_dir is None else TokenCache(cache_dir)
+    df = Counter() if cache is None else np.zeros(len(cache.vocab), dtype=np.int64)
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(stop, None, cache_dir)) as pool:
+        for i, batch_df in enumerate(pool.imap_unordered(_doc_freqs, batches)):
+            if cache is None:
+                df.update(batch_df)
+            else:
+                df += batch_df
+            if (i + 1) % 50 == 0:
+                print('Document frequencies: ' + str(i + 1) + '/' + str(len(batches)) + ' batches')
+    if cache is not None:
+        #Back from cache ids to terms, stop words are only dropped here on this path
+        stop_set = frozenset(stop)
+        df = {t: n for t, n in zip(cache.vocab, df) if n and t not in stop_set}
+    vocab = sorted(t for t, n in df.items() if n >= min_df)
+    print(str(len(vocab)) + ' of ' + str(len(df)) + ' terms are in at least ' + str(min_df) + ' files')
+    del df
+
+    rows = [None] * len(batches)
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(stop, vocab, cache_dir)) as pool:
+        for done, (i, batch_rows) in enumerate(pool.imap_unordered(_term_rows, enumerate(batches))):
+            rows[i] = batch_rows
+            if (done + 1) % 50 == 0:
+                print('Term counts: ' + str(done + 1) + '/' + str(len(batches)) + ' batches')
+    if not rows:
+        return scipy.sparse.csr_matrix((0, len(vocab)), dtype=np.int32), vocab
+    return scipy.sparse.vstack(rows, format='csr'), vocab
+
+
+def term_frequencies(X):
+    #Column sums in int64 straight off the sparse matrix, nothing gets densified
+    return np.asarray(X.sum(axis=0, dtype=np.int64)).ravel()
@@ -14,6 +14,12 @@ import math
 import pickle
 import scipy.sparse
 import csv
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.corpus import list_files
+from pmicalc.vocab_build import build_vocabulary, term_frequencies
+from pmicalc.vocab_incremental import update_store, filtered_matrix
+from pmicalc.freq_table import FreqTable
 
 '''
 This file generates a vocabulary to use for analysis and a dictionary that will let
@@ -28,35 +34,59 @@ def custom_preprocessor(w):
 	
 #File path to where the folder that the data is in is.
 #Folder the data is in
-files = ['/newdata/10-19_DATA_CLEAN_2019/10K/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2019/10K')] + ['/newdata/10-19_DATA_CLEAN_2019/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2019/10Q')] + ['/newdata/10-19_DATA_CLEAN_2020/10K2/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2020/10K2')] + ['/newdata/10-19_DATA_CLEAN_2020/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2020/10Q')] + ['/newdata/10-19_DATA_CLEAN_2021/10K/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2021/10K')] + ['/newdata/10-19_DATA_CLEAN_2021/10Q/' + f for f in os.listdir('/newdata/10-19_DATA_CLEAN_2021/10Q')]
+files = list_files()
 #Directory where you want the data to be outputted
 output_dir = "/newdata"
 #Named based on what type of files you're looking a, either 10K's, 10Q's or combined (10KQ).
 file_type = '10KQ_11-7'
+#Count the files in worker processes instead of one CountVectorizer.fit_transform
+parallel = True
+processes = os.cpu_count()
+#Roughly how much memory the workers may use for text at once
+memory_budget_mb = 16384
+#Token cache made by token_cache.py, None reads and tokenizes the raw files
+cache_dir = None
+#Keep per-file term counts in store_dir and only count new or changed files on each run
+incremental = False
+store_dir = '/newdata/vocab_store'
+min_df = 15
 
 reg = r"[A-Za-z]+-[A-Za-z]+-[0-9]|[a-zA-Z0-9]+-[a-zA-Z0-9]+|[a-zA-Z0-9]+"
 stop = [item for sublist in list(csv.reader(open('stop_list.csv',newline=''))) for item in sublist]
 print(stop)  
 print('running cv')
-cv = CountVectorizer(input = 'filename',token_pattern = reg,stop_words=stop, min_df = 15, dtype = np.int32)
-print('count vectorizer')
-X = cv.fit_transform(files)
+cv = CountVectorizer(input = 'filename',token_pattern = reg,stop_words=stop, min_df = min_df, dtype = np.int32)
+if incremental:
+	terms, counts = update_store(files, store_dir, stop, processes)
+	X, vocab = filtered_matrix(terms, counts, min_df)
+	del terms, counts
+elif parallel:
+	X, vocab = build_vocabulary(files, stop, min_df, processes, memory_budget_mb, cache_dir)
+else:
+	print('count vectorizer')
+	X = cv.fit_transform(files)
+	vocab = cv.get_feature_names()
+if incremental or parallel:
+	#Same settings with the vocabulary fixed, it validates itself on the first transform() after loading the pickle
+	cv = CountVectorizer(input = 'filename',token_pattern = reg,stop_words=stop, vocabulary=vocab, dtype = np.int32)
 print('files fitted')
 print(X.shape)
 pickle.dump(cv,open(f'cv_{file_type}.pkl','wb'))
 
 
-vocab = cv.get_feature_names()
 os.chdir(output_dir)
 scipy.sparse.save_npz(f'sparse_matrix_{file_type}.npz', X)
+#Which filing each row of the sparse matrix is
+with open(f'files_{file_type}.txt','w') as file_list:
+	file_list.write('\n'.join(files))
 
-vocab = cv.get_feature_names()
 print('saving vocab')
 np.savez('vocab_filtered_'+file_type,vocabulary=vocab)
 
-#small = X.astype(np.int16)
-count_list = X.astype(np.int16).toarray().sum(axis=0)
+count_list = term_frequencies(X)
 freq_dist = dict(zip(vocab,count_list))
+#Same counts as an array-backed table (see freq_table.py), loads in milliseconds
+FreqTable(vocab, count_list).save('freqtable_'+file_type, files)
 
 del vocab
 print('Saving freq dist')
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from collections import Counter
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pmicalc.vocab_build import file_terms
+
+'''
+Incremental version of the vocabulary and frequency step.
+
+A store directory keeps the term counts of every file counted so far, before any min_df
+filtering, so a refresh only has to count the files that are new or whose content
+changed, and drop the ones that are gone. The vocabulary, document-term matrix and
+frequencies are then recomputed from the stored counts.
+
+    manifest.json  path, sha1, size and mtime of every stored file, in row order
+    terms.txt      every term seen so far, one per line, in column order (only grows)
+    counts.npz     files x terms counts (int32)
+'''
+
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = frozenset(stop)
+
+
+def _count_file(path):
+    return path, Counter(file_terms(path, _stop))
+
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_atomic(path, write):
+    #write(file) fills a temporary file that then replaces path in one step
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        write(out)
+    os.replace(tmp, path)
+
+
+def load_store(store_dir):
+    '''Returns (entries, terms, counts), empty when the store does not exist yet'''
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return [], [], scipy.sparse.csr_matrix((0, 0), dtype=np.int32)
+    with open(manifest_path) as manifest_file:
+        entries = json.load(manifest_file)['files']
+    with open(os.path.join(store_dir, 'terms.txt'), encoding='utf-8') as terms_file:
+        terms = terms_file.read().split('\n')
+    if terms == ['']:
+        terms = []
+    with open(os.path.join(store_dir, 'counts.npz'), 'rb') as counts_file:
+        counts = scipy.sparse.load_npz(counts_file).tocsr()
+    return entries, terms, counts
+
+
+def save_store(store_dir, entries, terms, counts):
+    os.makedirs(store_dir, exist_ok=True)
+    _write_atomic(os.path.join(store_dir, 'terms.txt'), lambda out: out.write('\n'.join(terms).encode('utf-8')))
+    _write_atomic(os.path.join(store_dir, 'counts.npz'), lambda out: scipy.sparse.save_npz(out, counts))
+    #The manifest goes last, it is what says the other two are up to date
+    _write_atomic(os.path.join(store_dir, 'manifest.json'), lambda out: out.write(json.dumps({'files': entries}).encode('utf-8')))
+
+
+def _file_entry(path, old):
+    '''Manifest entry for path, only rehashing when size or mtime moved'''
+    stat = os.stat(path)
+    if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+        return old
+    return {'path': path, 'hash': file_hash(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def update_store(files, store_dir, stop, processes=None):
+    '''
+    Brings the store in store_dir in line with files: counts new and changed files, drops
+    removed ones and keeps everything else. Rows end up in the order of files.
+    Returns (terms, counts).
+    '''
+    entries, terms, counts = load_store(store_dir)
+    old = {e['path']: (i, e) for i, e in enumerate(entries)}
+    new_entries = [_file_entry(f, old[f][1] if f in old else None) for f in files]
+    kept = {e['path']: old[e['path']][0] for e in new_entries if e['path'] in old and old[e['path']][1]['hash'] == e['hash']}
+    to_count = [e['path'] for e in new_entries if e['path'] not in kept]
+    removed = len(set(old) - set(files))
+    print(str(len(kept)) + ' files unchanged, ' + str(len(to_count)) + ' to count, ' + str(removed) + ' removed')
+
+    term_map = {t: i for i, t in enumerate(terms)}
+    counted = {}
+    if to_count:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(processes, initializer=_init_worker, initargs=(stop,)) as pool:
+            for i, (path, term_counts) in enumerate(pool.imap_unordered(_count_file, to_count, chunksize=8)):
+                cols = np.fromiter((term_map.setdefault(t, len(term_map)) for t in term_counts), dtype=np.int64, count=len(term_counts))
+                counted[path] = (cols, np.fromiter(term_counts.values(), dtype=np.int32, count=len(term_counts)))
+                if i % 1000 == 0:
+                    print('Counted ' + str(i) + '/' + str(len(to_count)) + ' files')
+    terms = list(term_map)
+
+    #Old rows keep their columns, the matrix just gets wider for the new terms
+    counts = scipy.sparse.csr_matrix((counts.data, counts.indices, counts.indptr), shape=(counts.shape[0], len(terms)))
+    new_rows = [counted[f] for f in to_count]
+    new_counts = scipy.sparse.csr_matrix(
+        (np.concatenate([r[1] for r in new_rows]) if new_rows else np.zeros(0, dtype=np.int32),
+         np.concatenate([r[0] for r in new_rows]) if new_rows else np.zeros(0, dtype=np.int64),
+         np.concatenate([[0], np.cumsum([len(r[0]) for r in new_rows], dtype=np.int64)])),
+        shape=(len(new_rows), len(terms)))
+    stacked = scipy.sparse.vstack([counts, new_counts], format='csr')
+    #Row of every file in the stacked matrix, in the order of files
+    new_pos = {f: counts.shape[0] + i for i, f in enumerate(to_count)}
+    order = np.array([kept[f] if f in kept else new_pos[f] for f in files], dtype=np.int64)
+    counts = stacked[order, :]
+    counts.sort_indices()
+    save_store(store_dir, new_entries, terms, counts)
+    return terms, counts
+
+
+def filtered_matrix(terms, counts, min_df=15):
+    '''
+    Applies min_df to the stored counts. Returns the files x vocab matrix and the sorted
+    vocabulary, as CountVectorizer(min_df=min_df) would have built them.
+    '''
+    df = np.diff((counts > 0).tocsc().indptr)
+    keep = np.flatnonzero(df >= min_df)
+    keep = keep[np.argsort(np.asarray(terms, dtype=object)[keep])] if len(keep) else keep
+    return counts[:, keep].astype(np.int32).tocsr(), [terms[i] for i in keep]
@@ -1,8 +1,21 @@
+import os
 import pandas
-
-# Get job text
-report_text = pandas.read_csv("/newdata/covid10k/outputs/test2_2019.txt", sep="\t", header=None, low_memory=False)
-report_text.columns = ["Identifier", "Filename", "Text"]
+from pmicalc.chunk_index import ChunkReader, chunk_dir_index, read_index
+
+# Passage index: only ids and offsets are loaded and the text is read from the filings for
+# the passages pulled. Either the chunk directory itself, which indexes every chunk whatever
+# split the topic model saw, or an index fix_chunks.py --index wrote in the same run as the
+# text TSV the model was trained on. None loads the whole text TSV instead.
+index_path = None
+
+if index_path is None:
+    # Get job text
+    report_text = pandas.read_csv("/newdata/covid10k/outputs/test2_2019.txt", sep="\t", header=None, low_memory=False)
+    report_text.columns = ["Identifier", "Filename", "Text"]
+    columns = [0, "Filename", "Text"]
+else:
+    report_text = chunk_dir_index(index_path) if os.path.isdir(index_path) else read_index(index_path)
+    columns = [0, "Filename"]
 
 # Column 0 in doctopics is an incrementing integer, drop it
 # The new column 0 is the identifier and columns 1-101 are the topic proportions 
@@ -19,10 +32,15 @@ df_final = pandas.DataFrame(columns=["Identifier", "Filename", "Text", "Topic",]
 for i in range(50):
     # Grab the top 10 ids by a given topic's proportion
     top_id = doctopics.sort_values(i, ascending=False).drop_duplicates("Filename")[0][:10]
-    filtered = doctopics[doctopics[0].isin(top_id)][[0, "Filename", "Text"]]
+    filtered = doctopics[doctopics[0].isin(top_id)][columns]
     filtered['Topic'] = i
-    filtered.columns = ["Identifier", "Filename", "Text", "Topic"]
+    filtered.columns = ["Identifier", "Filename", "Text", "Topic"] if index_path is None else ["Identifier", "Filename", "Topic"]
     df_final = pandas.concat([df_final,filtered], axis=0)
+if index_path is not None:
+    # Text for just the pulled passages, memory-mapped from the cleaned filings
+    reader = ChunkReader(report_text)
+    df_final["Text"] = reader.texts(df_final["Identifier"])
+    reader.close()
 df_final.to_csv('../../outputs/passages_2019.csv')
 #filtered.to_csv('../../outputs/passages.csv')
 